@@ -0,0 +1,258 @@
+"""
+Module: candidates
+
+The swaps of a search level pair every predicate with every value that the
+column can take: the whole codebook of a DictValue constraint, or every
+distinct value of the column. A candidate index proposes only the values that
+are close to the value of a predicate, so there are fewer swaps to generate and
+score. The indexes are built once per search and they are opt-in, without them
+every value is proposed.
+"""
+
+import numpy as np
+
+
+class Candidates(object):
+    """The candidate indexes of a search, one per column
+    """
+
+    def __init__(self, similarity, codebookK=None, distance=None):
+        """Candidates constructor
+
+        Positional arguments:
+        similarity -- the CellEdit of the search, its metrics rank the values
+
+        Keyword arguments:
+        codebookK -- the number of codebook values proposed for the value of a
+                     predicate (None proposes the whole codebook)
+        distance -- the largest edit cost (from 0 to 1) of the values of a column
+                    proposed for a value of the same column (None proposes every
+                    value), for the columns with the 'edit' or 'jaccard' metric
+        """
+
+        self.similarity = similarity
+        self.codebookK = codebookK
+        self.distance = distance
+        self.indexes = {}
+        self.positions = {}
+
+
+    def enabled(self, codebook):
+        """Returns true if the values of a codebook (or of a column) are indexed"""
+
+        if codebook:
+            return self.codebookK != None
+
+        return self.distance != None
+
+
+    def select(self, column, predicate, values, codebook):
+        """The values that are candidates for a swap of the column under the
+        predicate, all of the values if they aren't indexed
+
+        Positional arguments:
+        column -- the column of the swap
+        predicate -- the predicate of the swap (column, set of values, tuples)
+        values -- the values of the value sampler
+        codebook -- true if the values are the codebook of the constraint
+        """
+
+        if not self.enabled(codebook):
+            return values
+
+        value = list(predicate[1])[0]
+
+        if codebook:
+            key = ('codebook', column)
+
+            if key not in self.indexes:
+                self.indexes[key] = CodebookIndex(column, values, self.similarity)
+
+            return self.indexes[key].nearest(value, self.codebookK)
+
+        #the values of a column are only comparable to values of the same column
+        if predicate[0] != column or value == None or self.similarity.metric[column] not in QGramIndex.METRICS:
+            return values
+
+        key = ('values', column)
+
+        if key not in self.indexes:
+            self.indexes[key] = QGramIndex(column, self.similarity, self.distance)
+
+        #the positions of the values with each string, for the values of this sampler
+        if key not in self.positions or self.positions[key][0] is not values:
+            positions = {}
+
+            for i, v in enumerate(values):
+                if v != None:
+                    positions.setdefault(str(v), []).append(i)
+
+            self.positions[key] = (values, positions)
+            self.indexes[key].update(positions)
+
+        positions = self.positions[key][1]
+        near = self.indexes[key].query(str(value))
+
+        return [values[i] for i in sorted(i for t in near if t in positions for i in positions[t])]
+
+
+
+class CodebookIndex(object):
+    """An exact nearest neighbor index over a codebook. The codebook values are
+    ranked by the edit cost of the column (e.g., the semantic distance, as one
+    matrix multiply over the embeddings of the codebook).
+    """
+
+    def __init__(self, column, codebook, similarity):
+        self.column = column
+        self.codebook = list(codebook)
+        self.similarity = similarity
+
+        #the nearest values of every value that was looked up
+        self.neighbors = {}
+
+
+    def nearest(self, value, k):
+        """The k codebook values that are nearest to a value, in codebook order"""
+
+        key = (type(value), value) if value == value else 'NaN'
+
+        if key not in self.neighbors:
+            costs = self.similarity.costs(self.column, self.codebook, value)
+
+            #ties are broken by the codebook order
+            nearest = np.sort(np.argsort(costs, kind='mergesort')[:k])
+            self.neighbors[key] = [self.codebook[i] for i in nearest]
+
+        return self.neighbors[key]
+
+
+
+class QGramIndex(object):
+    """An inverted index of the distinct values of a column that finds the values
+    within an edit cost of a value without comparing it to all of them. For the
+    edit distance, the postings are the q-grams of the values (padded at both
+    ends): two strings within k edits share at least max(|a|, |b|) + q - 1 - kq
+    q-grams and their lengths differ by at most k. For the jaccard distance, the
+    postings are the tokens: two values closer than 1 share a token. The values
+    that pass the filter are compared exactly, so the index returns the same
+    values as comparing every pair.
+    """
+
+    #the metrics that can be indexed
+    METRICS = set(['edit', 'jaccard'])
+
+    Q = 2
+
+    PAD = '\x00'
+
+    def __init__(self, column, similarity, distance):
+        """QGramIndex constructor
+
+        Positional arguments:
+        column -- the column of the values
+        similarity -- the CellEdit of the search
+        distance -- the largest edit cost of the values that a query returns
+        """
+
+        self.column = column
+        self.similarity = similarity
+        self.distance = distance
+        self.metric = similarity.metric[column]
+
+        self.texts = []
+        self.ids = {}
+        self.lengths = []
+
+        #gram -> (ids, counts)
+        self.postings = {}
+
+        #the near values of every value that was looked up
+        self.near = {}
+
+
+    def grams(self, text):
+        """The multiset of the postings of a value as a dict {gram: count}"""
+
+        grams = {}
+
+        if self.metric == 'jaccard':
+            for t in set(text.lower().split()):
+                grams[t] = 1
+
+            return grams
+
+        padded = self.PAD*(self.Q - 1) + text + self.PAD*(self.Q - 1)
+
+        for i in range(len(padded) - self.Q + 1):
+            g = padded[i:i + self.Q]
+            grams[g] = grams.get(g, 0) + 1
+
+        return grams
+
+
+    def add(self, text):
+        i = len(self.texts)
+
+        self.ids[text] = i
+        self.texts.append(text)
+        self.lengths.append(len(text))
+
+        for g, count in self.grams(text).items():
+            if g not in self.postings:
+                self.postings[g] = ([], [])
+
+            self.postings[g][0].append(i)
+            self.postings[g][1].append(count)
+
+
+    def update(self, texts):
+        """Adds the texts that aren't indexed yet"""
+
+        for t in texts:
+            if t not in self.ids:
+                self.add(t)
+                self.near.clear()
+
+
+    def query(self, text):
+        """The set of the indexed texts within the distance of a text"""
+
+        if text not in self.near:
+            candidates = self.candidates(text)
+            costs = self.similarity.costs(self.column, [self.texts[i] for i in candidates], text)
+
+            self.near[text] = set(self.texts[i] for i, c in zip(candidates, costs) if c <= self.distance)
+
+        return self.near[text]
+
+
+    def candidates(self, text):
+        """The ids of the indexed texts that pass the filter"""
+
+        N = len(self.texts)
+
+        if self.distance >= 1:
+            return np.arange(N)
+
+        shared = np.zeros((N,))
+
+        for g, count in self.grams(text).items():
+            if g in self.postings:
+                ids, counts = self.postings[g]
+                shared[ids] += np.minimum(counts, count)
+
+        #a value is also at distance 0 from itself if it has no tokens
+        if self.metric == 'jaccard':
+            if text in self.ids:
+                shared[self.ids[text]] += 1
+
+            return np.flatnonzero(shared > 0)
+
+        lengths = np.array(self.lengths)
+        longest = np.maximum(lengths, len(text))
+
+        #the number of edits of the distance (rounding up at the boundary)
+        k = np.floor(self.distance*longest + 1e-9)
+
+        return np.flatnonzero((np.abs(lengths - len(text)) <= k) & (shared >= longest + self.Q - 1 - self.Q*k))
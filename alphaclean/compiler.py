@@ -0,0 +1,347 @@
+"""
+Module: compiler
+
+The program that the search returns is a chain of operations, and every operation
+makes its own pass over the rows of the frame. The compiler turns the provenance
+of a program into a Plan of a few vectorized stages:
+
+    * swaps that write the same column conditioned on the same column are one
+      lookup table from the values of the condition to the new values,
+    * consecutive deletes of the same column are one mask,
+    * casts of the same column are one transform of its distinct values.
+
+An operation can move ahead of the stages before it as long as they neither read
+nor write the columns that it writes (and don't write the columns that it reads),
+so the plan runs the same as the program. As in the operations, values match by
+equality and NaN matches NaN.
+"""
+
+import numpy as np
+import pandas as pd
+
+from ops import Operation, Swap, Delete, DatetimeCast, PatternCast, FloatCast, NOOP, compose, \
+                isin, rowValues, writeColumn, deleteRows
+from delta import NAN_KEY, canonical, isNaN
+
+
+#the columns read or written by an operation that could touch any column
+ALL = None
+
+
+class Plan(Operation):
+    """A plan is a compiled program, it runs like the program that it was compiled
+    from and has the same name and provenance.
+    """
+
+    def __init__(self, program, stages):
+        """Plan constructor
+
+        Positional arguments:
+        program -- the Operation that the plan was compiled from
+        stages -- a list of Stages that run in order
+        """
+
+        self.stages = stages
+        self.name = program.name
+
+        def fn(df, stages=stages):
+
+            for stage in stages:
+                df = stage.run(df)
+
+            return df
+
+        super(Plan, self).__init__(fn, program.depth, program.provenance)
+
+
+    def explain(self):
+        """A description of the stages of the plan, one per line"""
+        return '\n'.join(str(s) for s in self.stages)
+
+
+    def __reduce__(self):
+        return (compileProgram, (compose(self.provenance),))
+
+
+
+class Stage(object):
+    """A stage is a group of operations that run in one pass over a column.
+    """
+
+    def __init__(self, op, column, reads, writes):
+        self.ops = [op]
+        self.column = column
+        self.reads = reads
+        self.writes = writes
+
+
+    def fuses(self, other):
+        """Returns true if the operations of the other stage can run in this stage"""
+        return False
+
+
+    def commutes(self, other):
+        """Returns true if this stage and the other stage can run in either order"""
+        return not overlaps(self.writes, other.reads) and \
+               not overlaps(self.writes, other.writes) and \
+               not overlaps(other.writes, self.reads)
+
+
+    def run(self, df):
+        raise NotImplementedError("Stage.run not implemented")
+
+
+    def __str__(self):
+        return self.__class__.__name__ + '(' + str(self.column) + ', ' + str(len(self.ops)) + ' operations)'
+
+
+
+class SwapStage(Stage):
+    """Swaps of a column conditioned on the same column: the last swap of a
+    row's value wins, or the swaps are composed if they condition on the column
+    that they write. The swaps run one by one if the type of the column could
+    change between them.
+    """
+
+    def __init__(self, op):
+        self.on = op.predicate[0]
+        super(SwapStage, self).__init__(op, op.column, set([self.on]), set([op.column]))
+
+
+    def fuses(self, other):
+        return isinstance(other, SwapStage) and other.column == self.column and other.on == self.on
+
+
+    def run(self, df):
+        table = {}
+
+        for op in self.ops:
+            keys = set(canonical(k) for k in op.predicate[1])
+
+            #values that an earlier swap wrote are swapped again
+            if self.on == self.column:
+                for k in table:
+                    if canonical(table[k]) in keys:
+                        table[k] = op.value
+
+            for k in keys:
+                if self.on != self.column or k not in table:
+                    table[k] = op.value
+
+        if len(table) == 0:
+            return df
+
+        keys = list(table.keys())
+        new = np.empty((len(keys),), dtype=object)
+        new[:] = [table[k] for k in keys]
+
+        positions = lookup(keys, df[self.on])
+        hits = np.flatnonzero(positions >= 0)
+
+        values = rowValues(df, self.column)
+
+        #every swap infers the type of the column it writes, which can recast the
+        #values of the next swaps (e.g., ints become floats next to a None). A row
+        #that no swap touches and holds a string keeps the column an object column
+        #between the swaps, so only then is the table the same as the swaps
+        if len(self.ops) > 1 and \
+           not any(isinstance(v, basestring) for v in values[positions < 0]):
+            for op in self.ops:
+                df = op.runfn(df)
+
+            return df
+
+        values[hits] = new[positions[hits]]
+
+        return writeColumn(df, self.column, values)
+
+
+
+class DeleteStage(Stage):
+    """Deletes of a column. A delete only writes None, so a row that an earlier
+    delete didn't match has its original values and all the deletes match
+    against the input of the stage.
+    """
+
+    def __init__(self, op):
+        super(DeleteStage, self).__init__(op, op.column, ALL, set([op.column]))
+
+
+    def fuses(self, other):
+        return isinstance(other, DeleteStage) and other.column == self.column
+
+
+    def run(self, df):
+        mask = np.zeros((df.shape[0],), dtype=bool)
+
+        for op in self.ops:
+            mask |= deleteRows(df, op.predicate)
+
+        values = rowValues(df, self.column)
+        values[mask] = None
+
+        return writeColumn(df, self.column, values)
+
+
+
+class CastStage(Stage):
+    """Casts of a column, every distinct value is cast once by all of the casts
+    that see the values of the cast before them as is. A cast that writes a
+    numerical column (a FloatCast, or any cast of a numerical column) stores its
+    values as pandas casts them (e.g., None is NaN), so the casts after it run
+    on the written column.
+    """
+
+    def __init__(self, op):
+        super(CastStage, self).__init__(op, op.column, set([op.column]), set([op.column]))
+
+
+    def fuses(self, other):
+        return isinstance(other, CastStage) and other.column == self.column
+
+
+    def cast(self, value, ops):
+        for op in ops:
+
+            #the date and the pattern casts skip missing values
+            if value == None and not isinstance(op, FloatCast):
+                continue
+
+            value = op.castValue(value)
+
+        return value
+
+
+    def run(self, df):
+        ops = []
+
+        for op in self.ops:
+
+            if len(ops) > 0 and (isinstance(ops[-1], FloatCast) or df[self.column].dtype != object):
+                df = self.runCasts(df, ops)
+                ops = []
+
+            ops.append(op)
+
+        return self.runCasts(df, ops)
+
+
+    def runCasts(self, df, ops):
+        column = df[self.column]
+        cache = {}
+
+        values = np.empty((df.shape[0],), dtype=object)
+
+        for i, v in enumerate(column.values):
+
+            #1 and 1.0 cast to different strings
+            try:
+                key = (type(v), v)
+                if key not in cache:
+                    cache[key] = self.cast(v, ops)
+                values[i] = cache[key]
+            except TypeError:
+                values[i] = self.cast(v, ops)
+
+        #the date and the pattern casts write cell by cell into the column
+        if not any(isinstance(op, FloatCast) for op in ops) and column.dtype == object:
+            df[self.column] = pd.Series(values, index=df.index, dtype=object)
+            return df
+
+        return writeColumn(df, self.column, values)
+
+
+
+class OperationStage(Stage):
+    """Any other operation runs as is, and it could read or write any column
+    """
+
+    def __init__(self, op):
+        super(OperationStage, self).__init__(op, None, ALL, ALL)
+
+
+    def run(self, df):
+        return self.ops[0].runfn(df)
+
+
+    def __str__(self):
+        return 'OperationStage(' + self.ops[0].name + ')'
+
+
+
+def compileProgram(program):
+    """Compiles a program into a Plan
+
+    Positional arguments:
+    program -- an Operation (e.g., the program returned by solve)
+    """
+
+    stages = []
+
+    for op in program.provenance:
+
+        if isinstance(op, NOOP):
+            continue
+
+        schedule(stages, stageOf(op))
+
+    return Plan(program, stages)
+
+
+
+def stageOf(op):
+    if isinstance(op, Swap):
+        return SwapStage(op)
+    elif isinstance(op, Delete):
+        return DeleteStage(op)
+    elif isinstance(op, (DatetimeCast, PatternCast, FloatCast)):
+        return CastStage(op)
+    else:
+        return OperationStage(op)
+
+
+
+def schedule(stages, stage):
+    """Fuses the stage into the latest stage that it can move up to, or appends it"""
+
+    for s in reversed(stages):
+
+        if s.fuses(stage):
+            s.ops.extend(stage.ops)
+            return
+
+        if not s.commutes(stage):
+            break
+
+    stages.append(stage)
+
+
+
+def overlaps(a, b):
+    """Returns true if two sets of columns (or ALL) intersect"""
+
+    if a is ALL:
+        return b is ALL or len(b) > 0
+
+    if b is ALL:
+        return len(a) > 0
+
+    return len(a.intersection(b)) > 0
+
+
+
+def lookup(keys, column):
+    """Returns the position in the keys of every value of the column (-1 if it
+    isn't a key), with the same matching as isin in the operations
+    """
+
+    values = column.values.astype(object)
+
+    index = pd.Index([np.nan if k is NAN_KEY else k for k in keys], dtype=object)
+    positions = index.get_indexer(values)
+
+    #the index only finds the NaN values that are the same object as its NaN
+    nan = [i for i, k in enumerate(keys) if k is NAN_KEY]
+    positions[isNaN(values)] = nan[0] if len(nan) > 0 else -1
+
+    return positions
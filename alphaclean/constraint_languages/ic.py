@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 from alphaclean.constraints import *
 
 """Module: ic
@@ -11,14 +12,24 @@ This module describes classes that represent various types of integrity constrai
 class FunctionalDependency(Constraint):
     """FunctionalDependency represents a functional dependency between two sets of attributes. A functional dependency (A -> B) implies that 
     for every value B there exists a single value A.
+
+    The score of a row is the number of distinct targets of its source key (minus one), normalized by the
+    largest number of distinct targets of any key. Missing values (None or NaN) are equal to each other.
     """
 
-    def __init__(self, source, target):
+    #number of indexed instances to remember
+    MEMORY = 8
+
+    def __init__(self, source, target, index=False):
         """FunctionalDependency constructor
 
         Positional arguments:
         source -- a list of attribute names
         target -- a list of attribute names
+
+        Keyword arguments:
+        index -- keep an FDIndex of the scored instances, so a branch of the search that
+                 changes a few rows is scored in the number of changed rows
         """
 
         self.source = source
@@ -27,37 +38,261 @@ class FunctionalDependency(Constraint):
         self.hint = set(source + target)
         self.hintParams = {}
 
+        self.index = index
+        self.indexes = {}
+
 
     def _qfn(self, df):
 
         N = df.shape[0]
-        kv = {}
-        normalization = 0
 
-        for i in range(N):
-            s = tuple(df[self.source].iloc[i,:])
-            t = tuple(df[self.target].iloc[i,:])
+        if N == 0:
+            return np.zeros((N,))
 
-            if s in kv:
-                kv[s].add(t)
-            else:
-                kv[s] = set([t])
+        sources = keyCodes([df[c].values for c in self.source])
+        targets = keyCodes([df[c].values for c in self.target])
+
+        #the number of distinct targets of every source key
+        pairs = np.unique(sources*(np.max(targets) + 1) + targets)
+        cardinality = np.bincount(pairs//(np.max(targets) + 1))[sources].astype(float)
+
+        qfn_a = (cardinality - 1)/np.max(cardinality)
+
+        if self.index:
+            self.remember(qfn_a, FDIndex([df[c].values for c in self.source], [df[c].values for c in self.target]))
+
+        return qfn_a
+
+
+    def qfnDelta(self, df, prev, delta):
 
-            normalization = max(len(kv[s]), normalization)
+        N = df.shape[0]
+
+        if N == 0 or not delta.touches(self.source + self.target):
+            return prev
+
+        if not self.index:
+            return self.qfn(df)
+
+        index = self.indexes.get(id(prev))
+
+        #index the instance before the delta
+        if index is None or index[0] is not prev:
+            index = self.remember(prev, FDIndex(self.before(df, delta, self.source), self.before(df, delta, self.target)))
+        else:
+            index = index[1]
+
+        qfn_a = index.score(rowKeys([take(df, c, delta.rows) for c in self.source]),
+                            rowKeys([take(df, c, delta.rows) for c in self.target]),
+                            rowKeys(self.old(df, delta, self.source)),
+                            rowKeys(self.old(df, delta, self.target)),
+                            delta.rows)
 
-        qfn_a = np.zeros((N,))
-        for i in range(N):
-            s = tuple(df[self.source].iloc[i,:])
-            qfn_a[i] = float(len(kv[s]) - 1)/normalization
+        #the old keys are not in the index, so it doesn't index the instance before the delta
+        if qfn_a is None:
+            return self.qfn(df)
 
         return qfn_a
 
 
+    def remember(self, qfn_a, index):
+
+        if len(self.indexes) >= self.MEMORY:
+            self.indexes.clear()
+
+        self.indexes[id(qfn_a)] = (qfn_a, index)
+
+        return index
+
+
+    def old(self, df, delta, columns):
+        """The values of the columns at the changed rows before the delta"""
+
+        values = []
+
+        for c in columns:
+            v = take(df, c, delta.rows).astype(object)
+
+            if c in delta.cells:
+                v[np.searchsorted(delta.rows, delta.cells[c])] = delta.old[c]
+
+            values.append(v)
+
+        return values
+
+
+    def before(self, df, delta, columns):
+        """The columns of the instance before the delta"""
+
+        values = []
+
+        for c in columns:
+            v = df[c].values
+
+            if c in delta.cells:
+                v = v.astype(object)
+                v[delta.cells[c]] = delta.old[c]
+
+            values.append(v)
+
+        return values
+
+
+
+class FDIndex(object):
+    """An FDIndex is the multiset of target keys of every source key of an instance, and the
+    rows of every source key. It scores an instance that differs in a few rows from the indexed
+    instance without changing the index, so branches can share it.
+    """
+
+    def __init__(self, sources, targets):
+        """FDIndex constructor
+
+        Positional arguments:
+        sources -- a list of the source columns (arrays) of the instance
+        targets -- a list of the target columns (arrays) of the instance
+        """
+
+        sourceCodes = keyCodes(sources)
+        targetCodes = keyCodes(targets)
+
+        sourceKeys = codeKeys(sources, sourceCodes)
+        targetKeys = codeKeys(targets, targetCodes)
+
+        self.codes = dict((k, i) for i, k in enumerate(sourceKeys))
+
+        #source key -> {target key: count}
+        self.targets = dict((k, {}) for k in sourceKeys)
+
+        T = len(targetKeys)
+        pairs, counts = np.unique(sourceCodes*T + targetCodes, return_counts=True)
+
+        for p, n in zip(pairs, counts):
+            self.targets[sourceKeys[p//T]][targetKeys[p % T]] = n
+
+        #the rows of every source key are a slice of the rows sorted by key
+        self.order = np.argsort(sourceCodes, kind='mergesort')
+        self.bounds = np.searchsorted(sourceCodes[self.order], np.arange(len(sourceKeys) + 1))
+
+        sizes = np.array([len(self.targets[k]) for k in sourceKeys])
+
+        self.cardinality = sizes[sourceCodes].astype(float)
+
+        #the number of source keys with each number of distinct targets
+        self.histogram = np.bincount(sizes)
+
+
+    def rows(self, key):
+        i = self.codes[key]
+        return self.order[self.bounds[i]:self.bounds[i+1]]
+
+
+    def score(self, sources, targets, oldSources, oldTargets, positions):
+        """Scores the instance where the rows at the positions changed from the old keys
+        to the new keys
+
+        Positional arguments:
+        sources -- the new source keys of the changed rows
+        targets -- the new target keys of the changed rows
+        oldSources -- the source keys of the changed rows in the indexed instance
+        oldTargets -- the target keys of the changed rows in the indexed instance
+        positions -- the row positions of the changed rows
+
+        Returns None if an old key is not a key of the indexed instance.
+        """
+
+        #the multisets of the keys that the changed rows move from or to
+        changed = {}
+
+        for s, t in zip(oldSources, oldTargets):
+            if s not in self.targets:
+                return None
+
+            counts = changed.setdefault(s, dict(self.targets[s]))
+
+            if counts.get(t, 0) <= 0:
+                return None
+
+            counts[t] -= 1
+
+            if counts[t] == 0:
+                del counts[t]
+
+        for s, t in zip(sources, targets):
+            counts = changed.setdefault(s, dict(self.targets.get(s, {})))
+            counts[t] = counts.get(t, 0) + 1
+
+        cardinality = self.cardinality.copy()
+        histogram = {}
+
+        for s, counts in changed.items():
+
+            if s in self.codes:
+                cardinality[self.rows(s)] = len(counts)
+                histogram[len(self.targets[s])] = histogram.get(len(self.targets[s]), 0) - 1
+
+            if len(counts) > 0:
+                histogram[len(counts)] = histogram.get(len(counts), 0) + 1
+
+        cardinality[positions] = [len(changed[s]) for s in sources]
+
+        #the largest number of distinct targets of a key that still has rows
+        normalization = max(len(self.histogram) - 1, max(histogram.keys()))
+
+        while normalization > 1 and self.keys(normalization) + histogram.get(normalization, 0) <= 0:
+            normalization -= 1
+
+        return (cardinality - 1)/normalization
+
+
+    def keys(self, cardinality):
+        """The number of source keys with a number of distinct targets"""
+
+        if cardinality < len(self.histogram):
+            return self.histogram[cardinality]
+
+        return 0
+
+
+
+def keyCodes(columns):
+    """Factorizes the rows of a list of columns (arrays) into an array of codes, in the order
+    of first appearance. Rows with equal values have the same code, missing values are equal.
+    """
+
+    codes = np.zeros((len(columns[0]),), dtype=np.int64)
+
+    for values in columns:
+        column, uniques = pd.factorize(values)
+        codes = pd.factorize(codes*(len(uniques) + 1) + column + 1)[0]
+
+    return codes
+
+
+def codeKeys(columns, codes):
+    """The key (see rowKeys) of every code, from the first row with that code"""
+
+    first = np.unique(codes, return_index=True)[1]
+    return rowKeys([c[first] for c in columns])
+
+
+#missing values are one key
+MISSING = ('MISSING',)
+
 
-def OneToOne(source, target):
+def rowKeys(columns):
+    """The rows of a list of columns (arrays) as tuples of values that compare like keyCodes"""
+
+    columns = [[MISSING if m else v for v, m in zip(c, pd.isnull(c))] for c in columns]
+
+    return list(zip(*columns))
+
+
+
+def OneToOne(source, target, index=False):
     """A OneToOne dependency is a common type of FD pair which we add some syntactic sugar for 
     """
-    return FunctionalDependency(source, target)*FunctionalDependency(target, source)
+    return FunctionalDependency(source, target, index)*FunctionalDependency(target, source, index)
 
 
 
@@ -65,6 +300,12 @@ def OneToOne(source, target):
 class DenialConstraint(Constraint):
     """A DenialConstraint is another way to represent a integrity constraints. A denial constraint
     is a set of predicates that cannot all be true. 
+
+    The predicates are over a tuple t1 (the row that is scored) and, for DCPairs and DCConstants
+    with other=True, another tuple t2 != t1. A row violates the constraint if its predicates are 
+    true and (if there are t2 predicates) there is a t2 for which the t2 predicates are true. The
+    declarative predicates are evaluated with sorted indexes, a DCPredicate evaluates its lambda
+    on every distinct value of its attribute.
     """
 
 
@@ -74,11 +315,12 @@ class DenialConstraint(Constraint):
 
         Positional arguments:
 
-        predicateList -- a List[DCPredicate]
+        predicateList -- a List[DCPredicate] (DCPredicates, DCConstants and DCPairs)
         """
 
         self.predicateList =  predicateList
-        self.attrs = set([dcp.local_attr for dcp in predicateList])
+        self.attrs = set([dcp.local_attr for dcp in predicateList]).union( \
+                     set([dcp.other_attr for dcp in predicateList if isinstance(dcp, DCPair)]))
         self.hint = self.attrs
         super(DenialConstraint,self).__init__(self.hint)
 
@@ -86,22 +328,121 @@ class DenialConstraint(Constraint):
     def _qfn(self, df):
 
         N = df.shape[0]
-        qfn_a = np.ones((N,))
 
-        for i in range(N):
+        local = np.ones((N,), dtype=bool)
+        other = np.ones((N,), dtype=bool)
+        pairs = []
 
-            for dcp in self.predicateList:
-                val = dcp.get(df).iloc[i]
+        for dcp in self.predicateList:
 
-                if val == None:
-                    qfn_a[i] = 0.0
-                    break
+            #null values don't satisfy any predicate
+            if isinstance(dcp, DCPair):
+                local &= pd.notnull(df[dcp.local_attr].values)
+                other &= pd.notnull(df[dcp.other_attr].values)
+                pairs.append(dcp)
 
-                if not dcp.eval(val,df):
-                    qfn_a[i] = 0.0
-                    break
+            elif isinstance(dcp, DCConstant) and dcp.other:
+                other &= dcp.mask(df)
 
-        return qfn_a
+            elif isinstance(dcp, DCConstant):
+                local &= dcp.mask(df)
+
+            #a lambda is only evaluated on the rows that the predicates before it are true for
+            else:
+                local = dcp.mask(df, local)
+
+        if len(pairs) == 0 and not any(isinstance(dcp, DCConstant) and dcp.other for dcp in self.predicateList):
+            return local.astype(float)
+
+        return self.join(df, local, other, pairs).astype(float)
+
+
+    def join(self, df, local, other, pairs):
+        """Returns the rows t1 (among the local rows) for which there is a row t2 != t1 (among the
+        other rows) such that all the pair predicates are true. Rows are grouped by the equality
+        predicates and then counted with a sorted index (or compared pairwise in chunks).
+        """
+
+        violations = np.zeros((df.shape[0],), dtype=bool)
+
+        rows1 = np.flatnonzero(local)
+        rows2 = np.flatnonzero(other)
+
+        if len(rows1) == 0 or len(rows2) == 0:
+            return violations
+
+        equalities = [p for p in pairs if p.op == '==']
+        rest = [p for p in pairs if p.op != '==']
+
+        if len(equalities) == 0:
+            violations[rows1] = self.exists(df, rows1, rows2, rest)
+            return violations
+
+        codes = keyCodes([np.concatenate([df[p.local_attr].values[rows1], df[p.other_attr].values[rows2]]) \
+                          for p in equalities])
+
+        order1 = np.argsort(codes[:len(rows1)], kind='mergesort')
+        order2 = np.argsort(codes[len(rows1):], kind='mergesort')
+
+        sorted1 = codes[:len(rows1)][order1]
+        sorted2 = codes[len(rows1):][order2]
+
+        keys = np.unique(sorted1)
+
+        starts1, ends1 = np.searchsorted(sorted1, keys, side='left'), np.searchsorted(sorted1, keys, side='right')
+        starts2, ends2 = np.searchsorted(sorted2, keys, side='left'), np.searchsorted(sorted2, keys, side='right')
+
+        for k in np.flatnonzero(ends2 > starts2):
+            group1 = rows1[order1[starts1[k]:ends1[k]]]
+            group2 = rows2[order2[starts2[k]:ends2[k]]]
+
+            violations[group1] = self.exists(df, group1, group2, rest)
+
+        return violations
+
+
+    def exists(self, df, rows1, rows2, pairs):
+        """For every row t1 in rows1, is there a row t2 != t1 in rows2 such that all the
+        pair predicates are true"""
+
+        if len(pairs) > 1 or (len(pairs) == 1 and pairs[0].op not in SORTED):
+            return self.compare(df, rows1, rows2, pairs)
+
+        if len(pairs) == 0:
+            counts = np.ones((len(rows1),), dtype=int)*len(rows2)
+        else:
+            values = df[pairs[0].other_attr].values[rows2]
+            values = values[np.argsort(values, kind='mergesort')]
+            counts = SORTED[pairs[0].op](values, df[pairs[0].local_attr].values[rows1])
+
+        #t1 can't be its own t2
+        own = np.in1d(rows1, rows2)
+
+        for p in pairs:
+            own[own] &= OPERATORS[p.op](df[p.local_attr].values[rows1[own]], 
+                                        df[p.other_attr].values[rows1[own]]).astype(bool)
+
+        return (counts - own) > 0
+
+
+    def compare(self, df, rows1, rows2, pairs, size=1000000):
+        """Compares chunks of the rows pairwise, for any other combination of predicates"""
+
+        result = np.zeros((len(rows1),), dtype=bool)
+        chunk = max(1, size//len(rows2))
+
+        for start in range(0, len(rows1), chunk):
+            rows = rows1[start:start+chunk]
+
+            holds = rows[:, None] != rows2[None, :]
+
+            for p in pairs:
+                holds &= OPERATORS[p.op](df[p.local_attr].values[rows][:, None], 
+                                         df[p.other_attr].values[rows2][None, :]).astype(bool)
+
+            result[start:start+chunk] = holds.any(axis=1)
+
+        return result
 
 
 
@@ -112,6 +453,9 @@ class DCPredicate(Constraint):
     * This predicate is applied to every row of the dataframe.
     * For each row, we can query an attribute called the "local attribute"
     * then, we can evaluate a boolean expression over this value and over the entire dataframe
+
+    The expression is opaque to the constraint, so it is evaluated on every distinct value of the
+    attribute. Where possible, use the declarative DCConstant and DCPair instead.
     """
     def __init__(self, local_attr, expression):
         """ DCPredicate contructor
@@ -143,6 +487,120 @@ class DCPredicate(Constraint):
         return self.expression(value, df)
 
 
+    def mask(self, df, rows):
+        """Evaluates the predicate on the rows of a boolean mask, returns the mask of the rows
+        that it is true for (None is false)
+
+        Positional arguments:
+        df -- a dataframe
+        rows -- a boolean array of the rows to evaluate
+        """
+
+        result = np.zeros((df.shape[0],), dtype=bool)
+        positions = np.flatnonzero(rows)
+
+        values = columnValues(self.get(df))[positions]
+        codes, uniques = distinct(values)
+
+        truth = np.array([bool(self.eval(u, df)) for u in uniques] + [False], dtype=bool)
+        result[positions] = truth[codes]
+
+        #NaN is evaluated like any other value
+        for k in np.flatnonzero(codes < 0):
+            result[positions[k]] = values[k] is not None and bool(self.eval(values[k], df))
+
+        return result
+
+
+
+class DCConstant(DCPredicate):
+    """A DCConstant compares an attribute of t1 (or of t2) to a constant, e.g., 
+    DCConstant('salary', '>', 100.0). The operators are ==, !=, <, <=, >, >= and contains
+    (a substring of a string attribute).
+    """
+
+    def __init__(self, local_attr, op, value, other=False):
+        """ DCConstant contructor
+
+        Positional arguments:
+        local_attr -- an attribute name
+        op -- an operator
+        value -- the constant
+
+        Keyword arguments:
+        other -- compares the attribute of t2 instead of t1
+        """
+
+        if op not in OPERATORS and op != 'contains':
+            raise ValueError("Unknown operator " + str(op))
+
+        self.op = op
+        self.value = value
+        self.other = other
+
+        super(DCConstant, self).__init__(local_attr, lambda x, df: self.test(np.array([x], dtype=object))[0])
+
+
+    def test(self, values):
+        """Evaluates the predicate on an array of values (that aren't null)"""
+
+        if self.op == 'contains':
+            return np.array([isinstance(v, basestring) and self.value in v for v in values], dtype=bool)
+
+        return OPERATORS[self.op](values, self.value).astype(bool)
+
+
+    def mask(self, df, rows=None):
+        values = df[self.local_attr].values
+        result = np.zeros((len(values),), dtype=bool)
+
+        present = np.flatnonzero(pd.notnull(values))
+        result[present] = self.test(values[present])
+
+        return result
+
+
+
+class DCPair(DCPredicate):
+    """A DCPair compares an attribute of t1 to an attribute of t2, e.g., DCPair('salary', '<', 'salary')
+    is t1.salary < t2.salary. The operators are ==, !=, <, <=, >, >=.
+    """
+
+    def __init__(self, local_attr, op, other_attr):
+        """ DCPair contructor
+
+        Positional arguments:
+        local_attr -- an attribute name of t1
+        op -- an operator
+        other_attr -- an attribute name of t2
+        """
+
+        if op not in OPERATORS:
+            raise ValueError("Unknown operator " + str(op))
+
+        self.op = op
+        self.other_attr = other_attr
+
+        super(DCPair, self).__init__(local_attr, lambda x, df: OPERATORS[op](x, df[other_attr].values).any())
+
+
+
+OPERATORS = {'==': np.equal,
+             '!=': np.not_equal,
+             '<': np.less,
+             '<=': np.less_equal,
+             '>': np.greater,
+             '>=': np.greater_equal}
+
+
+#the number of sorted t2 values that every t1 value is in the relation with
+SORTED = {'<': lambda s, x: len(s) - np.searchsorted(s, x, side='right'),
+          '<=': lambda s, x: len(s) - np.searchsorted(s, x, side='left'),
+          '>': lambda s, x: np.searchsorted(s, x, side='left'),
+          '>=': lambda s, x: np.searchsorted(s, x, side='right'),
+          '!=': lambda s, x: len(s) - (np.searchsorted(s, x, side='right') - np.searchsorted(s, x, side='left'))}
+
+
 
 class DictValue(Predicate):
     """
@@ -165,3 +623,8 @@ class DictValue(Predicate):
 
         super(DictValue, self).__init__(attr, lambda x, codebook=codebook: x in codebook)
 
+
+    def test(self, values):
+        """Looks up all the values in the codebook at once"""
+        return pd.Series(values, dtype=object).isin(self.codebook).values
+
@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 from alphaclean.constraints import *
 import re
 import time
@@ -86,9 +87,11 @@ class Pattern(Predicate):
         self.pattern = pattern
         self.attr = attr
 
+        self.regex = re.compile(pattern)
+
         def patternCheck(x, p):
 
-            if x == None or len(x) == 0 or x != x:
+            if x == None or x != x or len(x) == 0:
                 return False
 
             try:
@@ -101,3 +104,17 @@ class Pattern(Predicate):
         super(Pattern, self).__init__(attr, lambda x, p=pattern: patternCheck(x,p))
 
 
+    def test(self, values):
+        """Matches the compiled pattern against all the non-empty strings at once,
+        other values don't match
+        """
+
+        strings = np.array([isinstance(v, basestring) and len(v) > 0 for v in values], dtype=bool)
+        result = np.zeros((len(values),), dtype=bool)
+
+        if strings.any():
+            result[strings] = pd.Series(values[strings], dtype=object).str.match(self.regex, na=False).values
+
+        return result
+
+
@@ -1,10 +1,13 @@
+import numbers
 import numpy as np
 from alphaclean.constraints import *
 
 """Module: statistical
 
 This module specifies a number of classes representing statistical
-and numerical constraints.
+and numerical constraints. The quality functions are evaluated over the
+whole column at once, missing values (and values that aren't numbers)
+never fire.
 """
 
 
@@ -31,21 +34,10 @@ class Parameteric(Constraint):
         super(Parameteric, self).__init__(self.hint)
 
     def _qfn(self, df): 
-        N = df.shape[0]
-        qfn_a = np.zeros((N,))
-        vals = df[self.attr].dropna().values
-        mean = np.mean(vals)
-        std = np.std(vals)
-
-        for i in range(N):
-            val = df[self.attr].iloc[i]
-
-            if np.isnan(val) or np.abs(val-mean) < std*self.tolerance:
-                qfn_a[i] = 0.0
-            else:
-                qfn_a[i] = 1.0
+        x = numerical(df[self.attr])
+        vals = x[~np.isnan(x)]
 
-        return qfn_a
+        return outliers(x, np.mean(vals), np.std(vals)*self.tolerance)
 
 
 
@@ -72,21 +64,11 @@ class NonParametric(Constraint):
         super(NonParametric, self).__init__(self.hint)
 
     def _qfn(self, df): 
-        N = df.shape[0]
-        qfn_a = np.zeros((N,))
-        vals = df[self.attr].dropna().values
-        mean = np.median(vals)
-        std = np.median(np.abs(vals-mean))
-
-        for i in range(N):
-            val = df[self.attr].iloc[i]
-
-            if np.isnan(val) or np.abs(val-mean) < std*self.tolerance:
-                qfn_a[i] = 0.0
-            else:
-                qfn_a[i] = 1.0
+        x = numerical(df[self.attr])
+        vals = x[~np.isnan(x)]
+        median = np.median(vals)
 
-        return qfn_a
+        return outliers(x, median, np.median(np.abs(vals-median))*self.tolerance)
 
 
 
@@ -113,34 +95,10 @@ class Correlation(Constraint):
 
 
     def _qfn(self, df): 
-        N = df.shape[0]
-        qfn_a = np.zeros((N,))
-
-        x = df[self.attrs[0]].values
-        y = df[self.attrs[1]].values
-
-        mx = np.median(x[~np.isnan(x)])
-        my = np.median(y[~np.isnan(y)])
-
-        for i in range(N):
-            val1 = df[self.attrs[0]].iloc[i] - mx
-            val2 = df[self.attrs[1]].iloc[i] - my
-
-            if np.isnan(val1) or np.isnan(val2):
-                continue
-
-            if self.ctype == 'positive':
-                if np.sign(val1*val2) < 0:
-                    qfn_a[i] = np.abs(val1) + np.abs(val2)
-            else:
-                if np.sign(val1*val2) > 0:
-                    qfn_a[i] = math.abs(val1) + math.abs(val2)
+        x = numerical(df[self.attrs[0]])
+        y = numerical(df[self.attrs[1]])
 
-        #normalize
-        if np.sum(qfn_a) > 0:
-            qfn_a = qfn_a/np.max(qfn_a)
-
-        return qfn_a
+        return correlations(x, y, self.ctype != 'positive')
 
 
 
@@ -150,13 +108,18 @@ class NumericalRelationship(Constraint):
     whose deviaiton from this function is high.
     """
 
-    def __init__(self, attrs, fn, tolerance=5):
+    def __init__(self, attrs, fn, tolerance=5, vectorized=False):
         """A constructor for the numericalrelationship constraint
 
         Positional arguments:
         attrs -- a tuple of attributes
         fn -- a function domain(attr[1]) -> domain(attr[2])
         tolerance -- number of standard deviations
+
+        Keyword arguments:
+        vectorized -- if true, fn takes an array of values of attr[1] and returns
+                      the array of predictions (e.g., lambda x: 2*x + 1), otherwise
+                      it is called once per value
         """
 
         self.tolerance = tolerance
@@ -164,50 +127,250 @@ class NumericalRelationship(Constraint):
         self.hint = set(attrs)
         self.hintParams = {}
         self.fn = fn
+        self.vectorized = vectorized
 
         
         super(NumericalRelationship, self).__init__(self.hint)
 
 
+    def predict(self, values):
+        """The predictions of fn for an array of values of attr[1]"""
+
+        if self.vectorized:
+            return np.asarray(self.fn(values), dtype=float)
+
+        return np.array([self.fn(v) for v in values], dtype=float)
+
+
+    def residuals(self, x, y):
+        """The residuals of the values of attr[2] (y) from the predictions for the
+        values of attr[1] (x), NaN where either value is missing
+        """
+
+        residuals = np.full(len(x), np.nan)
+
+        valid = np.flatnonzero(~np.isnan(x) & ~np.isnan(y))
+
+        if len(valid) > 0:
+            residuals[valid] = y[valid] - self.predict(x[valid])
+
+        return residuals
+
+
     def _qfn(self, df): 
+        x = numerical(df[self.attrs[0]])
+        y = numerical(df[self.attrs[1]])
+
+        residuals = self.residuals(x, y)
+
+        if np.all(np.isnan(residuals)):
+            return np.zeros((df.shape[0],))
+
+        return deviations(residuals, self.tolerance)
+
+
+
+class CorrelationGroup(Constraint):
+    """A correlation group evaluates many Correlation and NumericalRelationship
+    constraints together (e.g., one per pair of neighboring rain gauges). The
+    columns are converted to floats and their medians are computed once for all
+    of the constraints, and the scores of the constraints are matrix operations
+    with one column per constraint. The quality function of the group is the
+    mean of the scores of its constraints.
+    """
+
+    def __init__(self, constraints):
+        """Constructor for a correlation group
+
+        Positional arguments:
+        constraints -- a list of Correlation and NumericalRelationship constraints
+        """
+
+        for c in constraints:
+            if not isinstance(c, (Correlation, NumericalRelationship)):
+                raise ValueError('A correlation group only has Correlation and NumericalRelationship constraints: ' + str(c))
+
+        self.constraints = constraints
+        self.hint = set()
+        self.hintParams = {}
+
+        #the columns of the float matrix in the order of the constraints
+        self.columns = []
+
+        for c in constraints:
+            for a in c.attrs:
+                if a not in self.hint:
+                    self.hint.add(a)
+                    self.columns.append(a)
+
+        super(CorrelationGroup, self).__init__(self.hint)
+
+
+    def qfns(self, df):
+        """The score vectors of the constraints as a matrix with one column per
+        constraint (in the order of the constraints)
+
+        Positional arguments:
+        df -- a pandas dataframe or an OverlayFrame
+        """
+
+        if isinstance(df, OverlayFrame):
+            df = df.materialize()
+
         N = df.shape[0]
-        qfn_a = np.zeros((N,))
+        scores = np.zeros((N, len(self.constraints)))
+
+        if N == 0 or len(self.constraints) == 0:
+            return scores
+
+        matrix = np.column_stack([numerical(df[a]) for a in self.columns])
+        position = dict((a, i) for i, a in enumerate(self.columns))
+
+        first = np.array([position[c.attrs[0]] for c in self.constraints])
+        second = np.array([position[c.attrs[1]] for c in self.constraints])
+
+        correlated = np.array([j for j, c in enumerate(self.constraints) if isinstance(c, Correlation)], dtype=int)
+        related = np.array([j for j, c in enumerate(self.constraints) if isinstance(c, NumericalRelationship)], dtype=int)
+
+        if len(correlated) > 0:
+            medians = nanmedians(matrix)
+            negative = np.array([self.constraints[j].ctype != 'positive' for j in correlated])
+
+            scores[:, correlated] = correlations(matrix[:, first[correlated]], matrix[:, second[correlated]],
+                                                 negative, medians[first[correlated]], medians[second[correlated]])
+
+        if len(related) > 0:
+            residuals = np.column_stack([self.constraints[j].residuals(matrix[:, first[j]], matrix[:, second[j]])
+                                         for j in related])
+
+            tolerance = np.array([self.constraints[j].tolerance for j in related], dtype=float)
+
+            scores[:, related] = deviations(residuals, tolerance)
+
+        return scores
+
+
+    def _qfn(self, df):
+        return np.mean(self.qfns(df), axis=1)
+
+
+
+def numerical(column):
+    """The values of a column as an array of floats, missing values and values
+    that aren't numbers are NaN
+    """
+
+    if column.dtype.kind in 'biuf':
+        return column.values.astype(float)
+
+    return np.array([v if isinstance(v, numbers.Real) else np.nan for v in column.values], dtype=float)
+
+
+
+def outliers(x, center, radius):
+    """Fires (1.0) on the values that aren't within the radius of the center"""
+
+    qfn_a = np.zeros((len(x),))
+
+    valid = ~np.isnan(x)
+    qfn_a[valid] = ~(np.abs(x[valid] - center) < radius)
+
+    return qfn_a
+
+
+
+def correlations(x, y, negative, mx=None, my=None):
+    """The scores of correlation constraints: a pair of values fires if they are
+    on different sides of their medians (or on the same side if the correlation
+    is negative), by their distance from the medians. The values are a vector
+    or a matrix with one column per constraint.
+
+    Positional arguments:
+    x -- the values of the first attributes as floats
+    y -- the values of the second attributes as floats
+    negative -- True if the correlation is negative (or an array, one per column)
+
+    Keyword arguments:
+    mx -- the medians of the first attributes (computed if None)
+    my -- the medians of the second attributes (computed if None)
+    """
+
+    mx = nanmedians(x) if mx is None else mx
+    my = nanmedians(y) if my is None else my
+
+    val1 = x - mx
+    val2 = y - my
+
+    with np.errstate(invalid='ignore'):
+        sign = np.sign(val1*val2)
+        fires = np.where(negative, sign > 0, sign < 0)
+
+    return normalize(np.where(fires, np.abs(val1) + np.abs(val2), 0.0))
+
+
+
+def deviations(residuals, tolerance):
+    """The scores of numerical relationships: a residual fires if it is more than
+    the tolerance standard deviations from the mean residual, by its deviation.
+    The residuals are a vector or a matrix with one column per constraint, NaN
+    residuals never fire.
+    """
+
+    valid = ~np.isnan(residuals)
+    count = np.sum(valid, axis=0)
+
+    filled = np.where(valid, residuals, 0.0)
+    mean = np.sum(filled, axis=0)/np.maximum(count, 1)
+    std = np.sqrt(np.sum(np.where(valid, (residuals - mean)**2, 0.0), axis=0)/np.maximum(count, 1))
+
+    deviation = np.abs(residuals - mean)
+
+    with np.errstate(invalid='ignore'):
+        fires = valid & (deviation > tolerance*std)
+
+    return normalize(np.where(fires, deviation, 0.0))
+
+
+
+def nanmedians(x):
+    """The medians of the values (or of every column) that aren't NaN"""
+
+    if x.shape[0] == 0:
+        return np.nan if x.ndim == 1 else np.full(x.shape[1], np.nan)
 
-        x = df[self.attrs[0]].values
-        y = df[self.attrs[1]].values
+    #one row per column
+    rows = np.ascontiguousarray(x.reshape((x.shape[0], -1)).T)
+    count = np.sum(~np.isnan(rows), axis=1)
 
-        residuals = []
-        for i in range(N):
-            val1 = df[self.attrs[0]].iloc[i]
-            val2 = df[self.attrs[1]].iloc[i]
+    low = np.maximum((count - 1)//2, 0)
+    high = count//2
 
-            if np.isnan(val1) or np.isnan(val2):
-                continue
+    medians = np.full(rows.shape[0], np.nan)
 
-            pred_val2 = self.fn(val1)
-            residual = val2 - pred_val2
-            residuals.append(residual)
+    #the columns without NaN are partitioned around the same middle, the others are sorted (NaN sorts last)
+    full = count == x.shape[0]
+    partial = np.flatnonzero(~full & (count > 0))
+    full = np.flatnonzero(full)
 
-        mean = np.mean(residuals)
-        std = np.std(residuals)
+    if len(full) > 0:
+        ordered = np.partition(rows[full], [low[full[0]], high[full[0]]], axis=1)
+        medians[full] = (ordered[:, low[full[0]]] + ordered[:, high[full[0]]])/2.0
 
-        for i in range(N):
-            val1 = df[self.attrs[0]].iloc[i]
-            val2 = df[self.attrs[1]].iloc[i]
+    if len(partial) > 0:
+        ordered = np.sort(rows[partial], axis=1)
+        medians[partial] = (ordered[np.arange(len(partial)), low[partial]] + \
+                            ordered[np.arange(len(partial)), high[partial]])/2.0
 
-            if np.isnan(val1) or np.isnan(val2):
-                continue
+    if x.ndim == 1:
+        return medians[0]
 
-            pred_val2 = self.fn(val1)
-            residual = val2 - pred_val2
+    return medians
 
-            if np.abs(residual-mean) > self.tolerance*std:
-                qfn_a[i] = np.abs(residual-mean)
 
 
-        #normalize
-        if np.sum(qfn_a) > 0:
-            qfn_a = qfn_a/np.max(qfn_a)
+def normalize(qfn_a):
+    """Scales the scores (or every column of scores) by their maximum"""
 
-        return qfn_a
+    top = np.max(qfn_a, axis=0)
 
+    return qfn_a/np.where(top > 0, top, 1.0)
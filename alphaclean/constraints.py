@@ -1,6 +1,11 @@
 import numpy as np
+import pandas as pd
 import distance 
 import logging
+import collections
+
+from alphaclean.overlay import OverlayFrame, take
+from alphaclean.word2vec import getEmbeddings
 
 
 """ Module: Constraints
@@ -42,8 +47,11 @@ class Constraint(object):
         calls the private method implemented by all the subclasses.
 
         Positional arguments:
-        df -- a pandas dataframe
+        df -- a pandas dataframe or an OverlayFrame
         """
+        if isinstance(df, OverlayFrame):
+            df = df.materialize()
+
         return self._qfn(df)
 
 
@@ -51,20 +59,25 @@ class Constraint(object):
         raise NotImplemented("Quality fn not implemented")
 
 
-    #the below methods implement a basic algebra over the quality functions
+    def qfnDelta(self, df, prev, delta):
+        """Evaluates the quality function for an instance that differs from a previously 
+        scored instance only in the cells of the delta. Subclasses that can update the 
+        previous score vector override this, the default rescores the whole instance.
 
+        Positional arguments:
+        df -- a pandas dataframe or an OverlayFrame
+        prev -- the score vector of the previous instance (it is not modified)
+        delta -- a Delta with the changed cells
+        """
+        return self.qfn(df)
 
-    def __add__(self, other):
-        """__add__ sums two quality functions """
-        c = Constraint()
-        c.qfn = lambda df: (self.qfn(df) + other.qfn(df))/2
 
-        c.hint = self.hint.union(other.hint)
+    #the below methods implement a basic algebra over the quality functions
 
-        c.hintParams =  self.hintParams.copy()
-        c.hintParams.update(other.hintParams)
 
-        return c
+    def __add__(self, other):
+        """__add__ sums two quality functions """
+        return CompositeConstraint([self, other], lambda a, b: (a + b)/2)
 
 
 
@@ -73,30 +86,76 @@ class Constraint(object):
         """__mul__ bitwise and relationship two quality functions """
         try: 
             fother = float(other)
-            c = Constraint()
-            c.qfn = lambda df: fother*self.qfn(df)
-            c.hint = self.hint.union(other.hint)
+            return CompositeConstraint([self], lambda a: fother*a)
+        except:
+            return CompositeConstraint([self, other], lambda a, b: np.maximum(a, b))
 
-            c.hintParams =  self.hintParams.copy()
-            c.hintParams.update(other.hintParams)
 
-            return c
-        except:
-            c = Constraint()
-            c.qfn = lambda df: np.maximum(self.qfn(df), other.qfn(df))
-            c.hint = self.hint.union(other.hint)
 
-            c.hintParams =  self.hintParams.copy()
-            c.hintParams.update(other.hintParams)
+class CompositeConstraint(Constraint):
+    """A composite constraint combines the score vectors of other constraints. It remembers 
+    the vectors of its children for the instances it recently scored, so it can update them
+    incrementally.
+    """
+
+    #number of scored instances to remember
+    MEMORY = 8
+
+    def __init__(self, children, combine):
+        """CompositeConstraint constructor
 
-            return c
+        Positional arguments:
+        children -- a list of constraints
+        combine -- a function mapping the children's score vectors to a score vector
+        """
+
+        self.children = children
+        self.combine = combine
+
+        self.hint = set()
+        self.hintParams = {}
+
+        for c in children:
+            self.hint = self.hint.union(c.hint)
+            self.hintParams.update(c.hintParams)
+
+        self.scored = {}
+
+
+    def qfn(self, df):
+        if isinstance(df, OverlayFrame):
+            df = df.materialize()
+
+        scores = [c.qfn(df) for c in self.children]
+        result = self.combine(*scores)
+
+        if len(self.scored) >= self.MEMORY:
+            self.scored.clear()
+
+        self.scored[id(result)] = (result, scores)
+
+        return result
+
+
+    def qfnDelta(self, df, prev, delta):
+        base = self.scored.get(id(prev))
+
+        if base is None or base[0] is not prev:
+            return self.qfn(df)
+
+        return self.combine(*[c.qfnDelta(df, s, delta) for c, s in zip(self.children, base[1])])
 
 
 class Predicate(Constraint):
     """A Predicate Constraint is the most basic type of a constraint, it isn't intended for direct use
-    but rather an important building block for more informative higher-level constraints.
+    but rather an important building block for more informative higher-level constraints. A predicate
+    is evaluated on the distinct values of its attribute, and it remembers the scores of the values 
+    it has seen (across the branches of the search).
     """
 
+    #number of distinct values to remember
+    CACHE_SIZE = 100000
+
     def __init__(self, attr, expr, none_penalty=0.01):
         """The constructor takes in an attribute and a lambda that maps the attribute value to a true or false.
 
@@ -115,32 +174,220 @@ class Predicate(Constraint):
 
         self.none_penalty = none_penalty
 
+        self.cache = {}
+
         super(Predicate,self).__init__(self.hint)
 
 
     def _qfn(self, df):
+        return self.scores(columnValues(df[self.attr]))
 
-        N = df.shape[0]
-        qfn_a = np.ones((N,))
 
-        for i in range(N):
-            val = df[self.attr].iloc[i]
+    def qfnDelta(self, df, prev, delta):
 
-            if val == None:
-                qfn_a[i] = self.none_penalty
+        if self.attr not in delta.cells:
+            return prev
 
-            elif self.expr(val):
-                qfn_a[i] = 0
+        positions = delta.cells[self.attr]
+        qfn_a = prev.copy()
+
+        #an edit that casts a numerical column (e.g., None into ints) changes the other
+        #rows too, and so does undoing it
+        if isinstance(df, OverlayFrame) and \
+           (df.castsColumn(self.attr, df.edits.get(self.attr, {}).values()) or \
+            df.castsColumn(self.attr, delta.old[self.attr])):
+            return self._qfn(df)
+
+        qfn_a[positions] = self.scores(take(df, self.attr, positions))
 
         return qfn_a
 
 
+    def scores(self, values):
+        """The score of every value in an array, every distinct value is scored once
+        """
+
+        codes, uniques = distinct(values)
+
+        qfn_a = np.ones((len(values),))
+
+        present = codes >= 0
+        qfn_a[present] = self.distinctScores(uniques)[codes[present]]
+
+        missing = np.flatnonzero(~present)
+
+        if len(missing) == 0:
+            return qfn_a
+
+        #None has a penalty and the other missing values (NaN) are scored by the expression
+        if values.dtype != object:
+            qfn_a[missing] = self._score(values[missing[0]])
+            return qfn_a
+
+        scored = {}
+
+        for i in missing:
+            t = type(values[i])
+
+            if t not in scored:
+                scored[t] = self._score(values[i])
+
+            qfn_a[i] = scored[t]
+
+        return qfn_a
+
+
+    def distinctScores(self, uniques):
+        """The scores of an array of distinct values that aren't missing, the
+        values that aren't cached are tested together
+        """
+
+        keys = [(type(v), v) for v in uniques]
+        cached = [self.cache.get(k) for k in keys]
+
+        unseen = np.array([c is None for c in cached], dtype=bool)
+        scores = np.array([0.0 if c is None else c for c in cached], dtype=float)
+
+        if unseen.any():
+            scores[unseen] = [0.0 if t else 1.0 for t in self.test(uniques[unseen])]
+
+            if len(self.cache) + np.sum(unseen) > self.CACHE_SIZE:
+                self.cache.clear()
+
+            for i in np.flatnonzero(unseen):
+                self.cache[keys[i]] = scores[i]
+
+        return scores
+
+
+    def test(self, values):
+        """Evaluates the expression on an array of values (that aren't None),
+        subclasses can override this with a vectorized test
+        """
+        return [self.expr(v) for v in values]
+
+
+    def _score(self, val):
+
+        if val == None:
+            return self.none_penalty
+
+        elif self.expr(val):
+            return 0
+
+        return 1
+
+
+
+#inferred types where equal values also have the same type
+HOMOGENEOUS = set(['string', 'unicode', 'bytes', 'integer', 'floating', 'boolean', 'empty'])
+
+
+def columnValues(column):
+    """The values of a column as an array, dates and other extension types are
+    boxed like the values of column.iloc
+    """
+
+    if column.dtype.kind in 'biufcO':
+        return column.values
+
+    return column.astype(object).values
+
+
+def distinct(values):
+    """Factorizes an array of values into codes and an array of the distinct
+    values. Equal values of different types (e.g., 1 and 1.0) are different
+    values, and missing values (None and NaN) have the code -1.
+    """
+
+    if values.dtype != object or pd.api.types.infer_dtype(values, skipna=True) in HOMOGENEOUS:
+        return pd.factorize(values)
+
+    missing = pd.isnull(values)
+
+    keys = pd.Series([None if m else (type(v), v) for v, m in zip(values, missing)], dtype=object)
+    codes, typed = pd.factorize(keys)
+
+    uniques = np.empty((len(typed),), dtype=object)
+    uniques[:] = [k[1] for k in typed]
+
+    return codes, uniques
+
+
+
+class LRUCache(object):
+    """A dict of a bounded size that evicts the least recently used keys
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+
+        value = self.items.pop(key)
+        self.items[key] = value
+
+        return value
+
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+
+def sameCells(targets, refs):
+    """True for the cells where the target and the ref are equal values of the
+    same type (so they have the same string), or are both NaN
+    """
+
+    if targets.dtype == refs.dtype and targets.dtype.kind in 'biu':
+        return targets == refs
+
+    if targets.dtype == refs.dtype and targets.dtype != object:
+        return (targets == refs) | (pd.isnull(targets) & pd.isnull(refs))
+
+    targets = targets.astype(object)
+    refs = refs.astype(object)
+
+    same = targets == refs
+
+    different = np.flatnonzero(~same)
+    same[different] = pd.isnull(targets[different]) & pd.isnull(refs[different])
+
+    #1 and 1.0 are equal with different strings, and so are None and NaN
+    kind = pd.api.types.infer_dtype(targets, skipna=False)
+
+    if kind not in HOMOGENEOUS or kind != pd.api.types.infer_dtype(refs, skipna=False):
+        same[same] = [type(a) is type(b) for a, b in zip(targets[same], refs[same])]
+
+    return same
+
+
 
 class CellEdit(Constraint):
     """CellEdit constraint is a quasi-constraint that penalizes modifications to the dataset. The user supplies a 
     source dataset and the constraint compares the edits with the current dataset and scores the changes.
+    Only the cells that changed are scored, and the distances are remembered across the branches and the
+    blocks of the search.
     """
 
+    #number of (metric, target, ref) distances to remember
+    CACHE_SIZE = 100000
+
+    distances = LRUCache(CACHE_SIZE)
+
     def __init__(self, source, metric={}, w2vModel=None):
         """CellEdit constructor allowed similarity metrics are 'jaccard', 'semantic', 'edit'
 
@@ -154,6 +401,9 @@ class CellEdit(Constraint):
 
         self.source = source
 
+        #the columns of the source as arrays
+        self.values = dict((c, source[c].values) for c in source.columns)
+
 
         #default the metric to 'edit' distance
         self.metric = {s: 'edit' for s in source.columns.values}
@@ -168,90 +418,184 @@ class CellEdit(Constraint):
                 semantic = True
 
         self.word_vectors = w2vModel
+        self.embeddings = getEmbeddings(w2vModel)
 
         if semantic and w2vModel == None:
             raise ValueError("Must provide a word2vec model if you are using semantic similarity")
 
-        self.cache = {}
+
+
+    def qfn(self, df):
+        #the cells of an OverlayFrame are scored without materializing it
+        return self._qfn(df)
 
 
     def _qfn(self, df):
         N = df.shape[0]
-        p = df.shape[1]
-        qfn_a = np.zeros((N,))
 
         if self.source.shape != df.shape:
             return np.ones((N,))
 
-        for i in range(N):
-            for j in range(p):
-                target = str(df.iloc[i,j])
-                ref = str(self.source.iloc[i,j])
-                cname = self.source.columns.values[j]
+        #nothing changed
+        if df is self.source or (isinstance(df, OverlayFrame) and df.base is self.source and len(df.edits) == 0):
+            return np.zeros((N,))
+
+        return self._rowScores(df, np.arange(N), np.zeros((N,)))
 
-                #some short circuits so you don't have to eval
-                if target == ref:
-                    continue
-                elif df.iloc[i,j] == None:
-                    continue
-                elif self.source.iloc[i,j] == None:
-                    qfn_a[i] = 1.0/p + qfn_a[i]
-                    continue 
-                elif target == '' and ref != target:
-                    qfn_a[i] = 1.0/p + qfn_a[i]
-                    continue 
-                elif ref == '' and ref != target:
-                    qfn_a[i] = 1.0/p + qfn_a[i]
-                    continue
 
+    def qfnDelta(self, df, prev, delta):
 
-                if self.metric[cname] == 'edit':
+        if self.source.shape != df.shape:
+            return np.ones((df.shape[0],))
 
-                    qfn_a[i] = self.edit(target,ref)/p + qfn_a[i]
-                
-                elif self.metric[cname] == 'jaccard':
-                    
-                    qfn_a[i] = self.jaccard(target, ref)/p + qfn_a[i]
+        #an edit that casts a numerical column changes the other rows too, and so
+        #does undoing a cast of the parent
+        for c in delta.cells:
+            if self.values[c].dtype == object:
+                continue
 
-                elif self.metric[cname] == 'semantic':
-                    qfn_a[i] = self.semantic(target, ref)/p + qfn_a[i]
+            if df[c].dtype != self.values[c].dtype:
+                return self._qfn(df)
 
-                else:
+            if isinstance(df, OverlayFrame) and \
+               (df.castsColumn(c, df.edits.get(c, {}).values()) or df.castsColumn(c, delta.old[c])):
+                return self._qfn(df)
 
-                    raise ValueError('Unknown Similarity Metric: ' + self.metric[cname])
+        return self._rowScores(df, delta.rows, prev.copy())
 
-        return qfn_a
 
+    def _rowScores(self, df, rows, qfn_a):
+        """Rescores the rows, only the cells that differ from the source are scored"""
 
-    def edit(self, target,ref):
-        return distance.levenshtein(target, ref, normalized=True)
+        columns = self.source.columns.values
+        p = len(columns)
 
-    def jaccard(self, target,ref):
-        ttokens = set(target.lower().split())
-        rtokens = set(ref.lower().split())
-        return (1.0 - (len(ttokens.intersection(rtokens))+0.)/ (len(ttokens.union(rtokens))+0.))
+        qfn_a[rows] = 0.0
 
+        for c in columns:
+            positions, targets = self._changed(df, c, rows)
 
-    def semantic(self, target, ref):
-        ttokens = set(target.lower().split())
-        rtokens = set(ref.lower().split())
+            for i, target, ref in zip(positions, targets, self.values[c][positions]):
+                qfn_a[i] = self._cellScore(c, target, ref)/p + qfn_a[i]
 
-        sim = []
-        for t in ttokens:
-            for r in rtokens:
+        return qfn_a
+
+
+    def _changed(self, df, column, rows):
+        """The positions (of the rows) and the values of the cells of a column that
+        differ from the source
+        """
+
+        numerical = self.values[column].dtype != object
+
+        #only the edited cells of an overlay of the source can differ from it
+        if isinstance(df, OverlayFrame) and df.base is self.source:
 
-                try:
-                    similarity = (self.word_vectors.similarity(t,r)+ 1.0)/2
-                except:
-                    similarity = 0
+            if column not in df.edits:
+                return rows[:0], rows[:0]
 
-                sim.append(similarity)
+            #an edit can cast a whole numerical column (e.g., ints to floats with NaN)
+            if numerical:
+                targets = df[column].values[rows]
+            else:
+                edited = np.array(sorted(df.edits[column]), dtype=int)
+                rows = edited[np.isin(edited, rows)]
+                targets = take(df, column, rows)
+
+        elif numerical:
+            targets = df[column].values[rows]
 
-        if len(sim) > 0:
-            return (1 - np.mean(sim)) 
         else:
+            targets = take(df, column, rows)
+
+        changed = ~sameCells(targets, self.values[column][rows])
+
+        return rows[changed], targets[changed]
+
+
+    def _cellScore(self, cname, target, ref):
+        """The edit cost of a cell that changed from ref to target (out of 1)"""
+
+        #some short circuits so you don't have to eval
+        if str(target) == str(ref):
+            return 0.0
+        elif target == None:
+            return 0.0
+        elif ref == None:
+            return 1.0
+
+        target = str(target)
+        ref = str(ref)
+
+        if target == '' or ref == '':
             return 1.0
 
+        metric = self.metric[cname]
+        key = self._distanceKey(metric, target, ref)
+
+        score = CellEdit.distances.get(key)
+
+        if score is None:
+            score = self.cellDistance(metric, target, ref)
+            CellEdit.distances.put(key, score)
+
+        return score
+
+
+    def _distanceKey(self, metric, target, ref):
+        if metric == 'semantic':
+            #semantic distances depend on the model
+            return (metric, id(self.word_vectors), target, ref)
+
+        return (metric, target, ref)
+
 
+    def costs(self, cname, targets, ref):
+        """The edit costs of changing a cell of a column from ref to each of the
+        targets, the semantic distances that aren't cached are computed together
+
+        Positional arguments:
+        cname -- a column name
+        targets -- a list of new values
+        ref -- the old value
+        """
+
+        metric = self.metric[cname]
+
+        if metric == 'semantic' and ref != None and str(ref) != '':
+            texts = [str(t) for t in targets if t != None]
+            texts = [t for t in set(texts) if t != '' and CellEdit.distances.get(self._distanceKey(metric, t, str(ref))) is None]
+
+            for t, d in zip(texts, self.semanticDistances(texts, [str(ref)])[:, 0]):
+                CellEdit.distances.put(self._distanceKey(metric, t, str(ref)), d)
+
+        return np.array([self._cellScore(cname, t, ref) for t in targets], dtype=float)
+
+
+    def cellDistance(self, metric, target, ref):
+        if metric == 'edit':
+            return self.edit(target, ref)
+        elif metric == 'jaccard':
+            return self.jaccard(target, ref)
+        elif metric == 'semantic':
+            return self.semantic(target, ref)
+        else:
+            raise ValueError('Unknown Similarity Metric: ' + metric)
+
+
+    def edit(self, target,ref):
+        return distance.levenshtein(target, ref, normalized=True)
+
+    def jaccard(self, target,ref):
+        ttokens = set(target.lower().split())
+        rtokens = set(ref.lower().split())
+        return (1.0 - (len(ttokens.intersection(rtokens))+0.)/ (len(ttokens.union(rtokens))+0.))
+
+
+    def semantic(self, target, ref):
+        return self.embeddings.distance(target, ref)
 
 
+    def semanticDistances(self, targets, refs):
+        """The semantic distances of every target to every ref as a matrix"""
+        return self.embeddings.distances(targets, refs)
@@ -74,25 +74,37 @@ class Dataset:
         
 
 
-    def getPredicatesDeterministic(self, qfn, col, granularity=None):
-        q_array = np.sign(qfn(self.df))
-        vals_inside = set()
-        vals_outside = set()
-        tuples_inside = set()
+    def getPredicatesDeterministic(self, qfn, col, granularity=None, scores=None):
+        """The predicates of the values of a column in the violating rows. A
+        predicate is (col, set([value]), rows) where rows are the index labels
+        of all of the violating rows of the frame.
+        """
+
+        #the scores of the quality function if they are already known
+        if scores is None:
+            scores = qfn(self.df)
+
+        inside = (np.sign(scores) == 1.0)
+
+        column = self.df[col]
 
-        for i in range(self.df.shape[0]):
+        #the values are boxed like the values of iloc
+        if column.dtype.kind in 'Mm':
+            values = column.astype(object).values[inside]
+        else:
+            values = column.values[inside]
 
-            val = self.df[col].iloc[i]
+        #the distinct values are added in row order (as the set of all of the values would be)
+        vals_inside = set()
 
+        for val in pd.unique(values):
 
             if val != val:
                 val = 'NaN'
 
-            if q_array[i] == 1.0:
-                vals_inside.add(val)
-                tuples_inside.add(tuple(self.df.iloc[i].dropna()))
-            else:
-                vals_outside.add(val)
+            vals_inside.add(val)
+
+        rows_inside = self.df.index[inside]
 
         def _translateNaN(x):
             if x == 'NaN' or x != x:
@@ -101,9 +113,7 @@ class Dataset:
                 return x
 
 
-        #print(tuples_inside)
-
-        return [(col, set([ _translateNaN(p)]), tuples_inside) for p in vals_inside]
+        return [(col, set([ _translateNaN(p)]), rows_inside) for p in vals_inside]
 
 
 
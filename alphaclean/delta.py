@@ -0,0 +1,113 @@
+"""
+Module: delta
+
+A Delta records the cells that an operation changed. The quality functions use
+it to update the score vector of the previous instance instead of rescoring
+the whole instance.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Delta(object):
+    """A delta is a set of changed cells grouped by column. The positions are
+    row positions (not index labels) and the old values are aligned with them.
+    """
+
+    def __init__(self, cells={}, old={}):
+        """Delta constructor
+
+        Keyword arguments:
+        cells -- a dict mapping a column to an array of changed row positions
+        old -- a dict mapping a column to an array of the values before the change
+        """
+
+        self.cells = dict((c, p) for c, p in cells.items() if len(p) > 0)
+        self.old = dict((c, old[c]) for c in self.cells)
+
+        if len(self.cells) > 0:
+            self.rows = np.unique(np.concatenate(list(self.cells.values())))
+        else:
+            self.rows = np.zeros((0,), dtype=int)
+
+
+    def touches(self, columns):
+        """Returns true if any of the columns changed"""
+        return any(c in self.cells for c in columns)
+
+
+    def __len__(self):
+        return len(self.rows)
+
+
+
+#nan isn't equal to itself, so NaN values share one key in dicts and sets
+NAN_KEY = ('NaN',)
+
+
+def canonical(value):
+    """The key of a value in a dict or a set, every NaN has the same key (None
+    is not NaN)
+    """
+
+    if value is not None and value != value:
+        return NAN_KEY
+
+    return value
+
+
+
+def isNaN(values):
+    """A boolean array of the NaN values of an array (None is not NaN)"""
+    return pd.isnull(values) & ~np.equal(values, None)
+
+
+
+def sameValues(a, b):
+    """Elementwise equality of two arrays where None only equals None and NaN only
+    equals NaN (the quality functions score None and NaN differently)
+    """
+
+    try:
+        with np.errstate(invalid='ignore'):
+            eq = np.asarray(a == b, dtype=bool)
+    except:
+        eq = None
+
+    #numpy gives up on some object comparisons, then everything changed
+    if eq is None or eq.shape != a.shape:
+        return np.zeros(a.shape, dtype=bool)
+
+    nulls = pd.isnull(a) & pd.isnull(b) & (np.equal(a, None) == np.equal(b, None))
+
+    return eq | nulls
+
+
+
+def diff(before, after, columns):
+    """Computes the delta between two instances with the same rows, only looking
+    at the given columns. Returns None if the instances are not comparable.
+
+    Positional arguments:
+    before -- a dataframe
+    after -- a dataframe
+    columns -- the columns that could have changed
+    """
+
+    if before.shape != after.shape:
+        return None
+
+    cells = {}
+    old = {}
+
+    for c in columns:
+        a = before[c].values
+        b = after[c].values
+
+        positions = np.flatnonzero(~sameValues(a, b))
+
+        cells[c] = positions
+        old[c] = a[positions]
+
+    return Delta(cells, old)
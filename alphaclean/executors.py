@@ -0,0 +1,149 @@
+"""
+Module: executors
+
+The branches of a search level are independent of each other, so they can be
+scored in any order. An executor schedules this work and always returns the
+results in the order of its inputs, so the reduction in treeSearch picks the
+same branch no matter how the work was scheduled.
+"""
+
+import sys
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+
+class Executor(object):
+    """An executor maps a function over a list of work items.
+    """
+
+    #whether results can reference memory owned by the caller (e.g., frames)
+    sharesMemory = True
+
+    def __init__(self, workers=None):
+        """Executor constructor
+
+        Keyword arguments:
+        workers -- the number of workers, defaults to the number of cores
+        """
+        self.workers = workers or multiprocessing.cpu_count()
+
+
+    def map(self, fn, items, chunksize=None):
+        """Applies fn to every item and returns the results in input order
+
+        Positional arguments:
+        fn -- a function item -> result
+        items -- a list of work items
+
+        Keyword arguments:
+        chunksize -- the number of items handed to a worker at once
+        """
+        raise NotImplementedError("Executor.map not implemented")
+
+
+    def chunksize(self, items, chunksize=None):
+        return chunksize or max(1, len(items) // (4*self.workers))
+
+
+
+class SerialExecutor(Executor):
+    """Runs every item in the calling thread. This is the default.
+    """
+
+    def __init__(self, workers=1):
+        super(SerialExecutor, self).__init__(workers)
+
+
+    def map(self, fn, items, chunksize=None):
+        return [fn(i) for i in items]
+
+
+
+class ThreadExecutor(Executor):
+    """Runs items on a thread pool. Most of the per-branch work happens inside
+    numpy and pandas, so threads share the frames without any copies.
+    """
+
+    def map(self, fn, items, chunksize=None):
+
+        if len(items) <= 1:
+            return [fn(i) for i in items]
+
+        pool = ThreadPool(self.workers)
+
+        try:
+            return pool.map(fn, items, self.chunksize(items, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+
+
+
+#the work of a process pool is passed by forking, the operations and the
+#constraints hold closures so they cannot be pickled to the workers
+_FORK_CONTEXT = None
+
+
+def _forkInvoke(i):
+    fn, items = _FORK_CONTEXT
+    return fn(items[i])
+
+
+class ProcessExecutor(Executor):
+    """Runs items on a pool of forked processes. The workers inherit the
+    function and the items from the parent, only the results are pickled
+    back, so results should be small (e.g., a score and not a frame).
+    """
+
+    sharesMemory = False
+
+    def map(self, fn, items, chunksize=None):
+        global _FORK_CONTEXT
+
+        if len(items) <= 1:
+            return [fn(i) for i in items]
+
+        if sys.platform == 'win32':
+            logging.warning('Process executors need fork, falling back to a serial executor')
+            return [fn(i) for i in items]
+
+        #pool workers are daemons and cannot fork a nested pool
+        if multiprocessing.current_process().daemon:
+            return [fn(i) for i in items]
+
+        _FORK_CONTEXT = (fn, items)
+        pool = multiprocessing.Pool(self.workers)
+
+        try:
+            return pool.map(_forkInvoke, range(len(items)), self.chunksize(items, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+            _FORK_CONTEXT = None
+
+
+
+EXECUTORS = {'serial': SerialExecutor,
+             'thread': ThreadExecutor,
+             'process': ProcessExecutor}
+
+
+def getExecutor(name='serial', workers=None):
+    """Returns an executor given its name or an executor object
+
+    Keyword arguments:
+    name -- 'serial', 'thread', 'process' or an Executor
+    workers -- the number of workers
+    """
+
+    if isinstance(name, Executor):
+        return name
+
+    if name not in EXECUTORS:
+        raise ValueError('Unknown executor: ' + str(name))
+
+    if name == 'serial':
+        return SerialExecutor()
+
+    return EXECUTORS[name](workers)
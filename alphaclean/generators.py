@@ -3,20 +3,25 @@ This module generates feasible parameter settings, the settings
 are in a form of an ordered list
 """
 
-from itertools import combinations, product
+from itertools import combinations, product, chain
 from ops import *
 from constraints import *
 from core import *
+from delta import canonical, isNaN, NAN_KEY
 import copy
+import heapq
 import string
 import logging
+import numpy as np
+import pandas as pd
 
 
 class ParameterSampler(object):
 
-    def __init__(self, df, qfn, operationList, similarity, substrThresh=0.1, scopeLimit=3, predicate_granularity=None):
+    def __init__(self, df, qfn, operationList, similarity, substrThresh=0.1, scopeLimit=3, predicate_granularity=None, scores=None, candidates=None):
         self.df = df
         self.qfn = qfn.qfn
+        self.scores = scores
         self.qfnobject = qfn
         self.substrThresh = substrThresh
         self.scopeLimit = scopeLimit
@@ -24,8 +29,17 @@ class ParameterSampler(object):
         self.predicate_granularity = predicate_granularity
         self.similarity = similarity
 
+        #an index that proposes the values of the swaps of a predicate
+        self.candidates = candidates
+
         self.predicateIndex = {}
 
+        #the semantic distances of a predicate value to every codebook value
+        self.codebookDistances = {}
+
+        #the violations covered by the values of a column, for the priority of an operation
+        self.coverages = {}
+
         self.dataset = Dataset(df)
 
 
@@ -51,13 +65,9 @@ class ParameterSampler(object):
                         #print(pv)
                         grid.append(self.indexToFun(pv, col))
 
-                    augProduct = []
-                    for p in product(*grid):
-                        v = list(p)
-                        v.insert(0, col)
-                        augProduct.append(tuple(v))
+                    colParams.append(self.columnProduct(col, orig, grid))
 
-                    colParams.extend(augProduct)
+                colParams = chain.from_iterable(colParams)
 
                 parameters.append((op, colParams, origParam))
 
@@ -75,32 +85,143 @@ class ParameterSampler(object):
         return parameters
 
 
-    def getAllOperations(self):
+    def columnProduct(self, col, orig, grid):
+        """Yields the parameters of an operation on a column, the column first"""
+
+        for p in self.candidateProduct(col, orig, grid):
+            v = list(p)
+            v.insert(0, col)
+            yield tuple(v)
+
+
+    def candidateProduct(self, col, orig, grid):
+        """The product of the parameter grid of a column, where the values are
+        only the candidates of the predicate if there is a candidate index
+        """
+
+        codebook = 'codebook' in self.qfnobject.hintParams
+
+        if self.candidates == None or not self.candidates.enabled(codebook) or \
+           ParametrizedOperation.VALUE not in orig or ParametrizedOperation.PREDICATE not in orig:
+            return product(*grid)
+
+        return self.candidateParams(col, orig, grid, codebook)
+
+
+    def candidateParams(self, col, orig, grid, codebook):
+        v = orig.index(ParametrizedOperation.VALUE)
+        p = orig.index(ParametrizedOperation.PREDICATE)
+
+        for params in product(*[g for i, g in enumerate(grid) if i != v]):
+            params = list(params)
+            predicate = params[p if p < v else p - 1]
+
+            for value in self.candidates.select(col, predicate, grid[v], codebook):
+                yield tuple(params[:v] + [value] + params[v:])
+
+
+    def getAllOperations(self, budget=None):
+
+        operations = list(self.iterOperations(budget))
+
+        logging.debug("Library generator created "+str(len(operations)) + " operations")
+        
+        return operations 
+
+
+    def iterOperations(self, budget=None):
+        """Yields the operations of the parameter grid and then the NOOP. The
+        parameters are generated lazily and an operation is only built when it
+        is yielded.
+
+        Keyword arguments:
+        budget -- the number of operations to yield before the NOOP, the ones
+                  that cover the most violations (None yields all of them in
+                  grid order)
+        """
+
+        if budget == None:
+            for op, arg in self.iterArguments():
+                yield op(**arg)
+
+        else:
+            #only the parameters of the best operations so far are kept
+            best = heapq.nsmallest(budget, ((-self.priority(arg), l, op, arg) \
+                                            for l, (op, arg) in enumerate(self.iterArguments())))
+
+            for _, _, op, arg in best:
+                yield op(**arg)
+
+        yield NOOP()
+
+
+    def iterArguments(self):
+        """Yields the operation and the arguments of every point of the parameter
+        grid that isn't pruned, in grid order
+        """
 
         parameterGrid = self.getParameterGrid()
-        operations = []
 
         for i , op in enumerate(self.operationList):
-            args = {}
+            keys = list(op.paramDescriptor.keys())
 
-            #print(parameterGrid[i][1])
-            
             for param in parameterGrid[i][1]:
                 arg = {}
-                for j, k in enumerate(op.paramDescriptor.keys()):
+                for j, k in enumerate(keys):
                     arg[k] = param[j]
                 
                 #optimization
                 if self.pruningRules(arg):
                     continue
 
-                operations.append(op(**arg))
+                yield op, arg
 
-        operations.append(NOOP())
 
-        logging.debug("Library generator created "+str(len(operations)) + " operations")
-        
-        return operations 
+    def priority(self, arg):
+        """The estimated cost reduction of an operation: the sum of the scores of
+        the violating rows that its predicate covers, or of all of the violating
+        rows if it doesn't have a predicate
+        """
+
+        if 'predicate' not in arg:
+            return self.coverage(None)[None]
+
+        column, values = arg['predicate'][0:2]
+        covered = self.coverage(column)
+
+        return sum(covered.get(canonical(v), 0.0) for v in values)
+
+
+    def coverage(self, column):
+        """A dict of every value of a column to the sum of the scores of the
+        violating rows with that value, NaN values under NAN_KEY (the column
+        None has the sum of all of them under the key None)
+        """
+
+        if column not in self.coverages:
+
+            if self.scores is None:
+                self.scores = self.qfn(self.df)
+
+            violations = np.maximum(np.asarray(self.scores, dtype=float), 0)
+
+            if column is None:
+                self.coverages[column] = {None: np.sum(violations)}
+            else:
+                values = self.df[column].values.astype(object)
+                codes, uniques = pd.factorize(values)
+                present = codes >= 0
+                nans = isNaN(values)
+
+                sums = np.bincount(codes[present], weights=violations[present], minlength=len(uniques))
+
+                covered = dict(zip(uniques, sums))
+                covered[NAN_KEY] = np.sum(violations[nans])
+                covered[None] = np.sum(violations[~present & ~nans])
+
+                self.coverages[column] = covered
+
+        return self.coverages[column]
 
 
 
@@ -116,7 +237,7 @@ class ParameterSampler(object):
             if 'codebook' in self.qfnobject.hintParams:
                 sim = self.qfnobject.threshold
                 
-                if self.similarity.semantic(str(arg['value']), str(list(arg['predicate'][1])[0])) > sim:
+                if self.codebookDistance(arg['value'], list(arg['predicate'][1])[0]) > sim:
                     return True
 
 
@@ -135,6 +256,27 @@ class ParameterSampler(object):
 
 
 
+    def codebookDistance(self, value, ref):
+        """The semantic distance of a codebook value to a value, the distances of
+        the value to the whole codebook are computed at once
+        """
+
+        ref = str(ref)
+
+        if ref not in self.codebookDistances:
+            codebook = [str(c) for c in self.qfnobject.hintParams['codebook']]
+            distances = self.similarity.semanticDistances([ref], codebook)[0]
+            self.codebookDistances[ref] = dict(zip(codebook, distances))
+
+        distances = self.codebookDistances[ref]
+        value = str(value)
+
+        if value not in distances:
+            return self.similarity.semantic(value, ref)
+
+        return distances[value]
+
+
     def indexToFun(self, index, col=None):
         if index == ParametrizedOperation.COLUMN:
             return self.columnSampler()
@@ -226,11 +368,9 @@ class ParameterSampler(object):
 
         for c in self.qfnobject.hint:
             #if self.dataset.types[c] == 'cat': #only take categorical values
-            all_predicates.extend(self.dataset.getPredicatesDeterministic(self.qfn, c, self.predicate_granularity))
+            all_predicates.extend(self.dataset.getPredicatesDeterministic(self.qfn, c, self.predicate_granularity, self.scores))
 
         logging.debug("Predicate Sampler has "+str(len(all_predicates)))
         
         return all_predicates
         #return self.dataset.getPredicates(self.qfn, self.predicate_granularity)
-
-
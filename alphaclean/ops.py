@@ -10,6 +10,10 @@ import re
 import pandas as pd
 import datetime
 import logging
+from functools import reduce
+from delta import Delta, diff, canonical, isNaN, NAN_KEY
+from overlay import OverlayFrame, take
+import numpy as np
 
 
 
@@ -61,6 +65,32 @@ class Operation(object):
         return op
 
 
+    """
+    This runs the operation on an OverlayFrame and returns the
+    new OverlayFrame and the Delta of the changed cells. Operations
+    that can't write into the overlay run on a materialized frame.
+    """
+    def runOverlay(self, state):
+        before = state.materialize()
+        after = self.run(before)
+        delta = self.delta(before, after)
+        return state.rebase(after, delta), delta
+
+    """
+    Returns the cells that running this operation on before changed,
+    None if the operation doesn't know which columns it touches
+    """
+    def delta(self, before, after):
+        return None
+
+    """
+    Operations are pickled by their provenance, so they can be
+    sent between processes
+    """
+    def __reduce__(self):
+        return (compose, (self.provenance,))
+
+
     def __str__(self):
         return self.name
 
@@ -68,6 +98,35 @@ class Operation(object):
 
 
 
+def compose(operations):
+    """
+    Composes a list of operations in order
+    """
+    return reduce(lambda a, b: a * b, operations)
+
+
+
+def contentProgram(program, df):
+    """
+    Runs a program on a dataframe and returns the program where every delete
+    matches its rows by their content (see Delete.onContent) and the output of
+    the program
+    """
+    df = df.copy(deep=True)
+    operations = []
+
+    for op in program.provenance:
+
+        if isinstance(op, Delete):
+            op = op.onContent(df)
+
+        operations.append(op)
+        df = op.runfn(df)
+
+    return compose(operations), df
+
+
+
 
 """
 A parametrized operation is an operation that
@@ -104,6 +163,12 @@ class ParametrizedOperation(Operation):
                 raise ValueError("Parameter " + str(p) + " has an invalid descriptor")
 
 
+    def delta(self, before, after):
+
+        #every parametrized operation rewrites a single column
+        return diff(before, after, [self.column])
+
+
 """
 Find an replace operation
 """
@@ -115,31 +180,19 @@ class Swap(ParametrizedOperation):
 
     def __init__(self, column, predicate, value):
 
-        #print("a,b", column, value)
-
-        logical_predicate = lambda row: (row[predicate[0]] in predicate[1])
-
         self.column = column
         self.predicate = predicate
         self.value = value
 
         def fn(df, 
                column=column, 
-               predicate=logical_predicate, 
+               matches=self.matches, 
                v=value):
 
-            def __internal(row):
-                #print(tuple(row.values), predicate(row))
-                if predicate(row):
-                    return v 
-                else:
-                    return row[column]
+            values = rowValues(df, column)
+            values[matches(df)] = v
 
-            df[column] = df.apply(lambda row: __internal(row), axis=1)
-
-            #print(df.apply(lambda row: __internal(row), axis=1))
-
-            return df
+            return writeColumn(df, column, values)
 
 
         self.name = 'df = swap(df,'+formatString(column)+','+formatString(value)+','+str(predicate[0:2])+')'
@@ -148,6 +201,20 @@ class Swap(ParametrizedOperation):
         super(Swap,self).__init__(fn, ['column', 'predicate', 'value'])
 
 
+    def matches(self, df):
+        """The positions of the rows of a dataframe or an OverlayFrame that match the predicate"""
+        return np.flatnonzero(isin(df[self.predicate[0]], self.predicate[1]))
+
+
+    def runOverlay(self, state):
+        positions = self.matches(state)
+        return state.withEdits(self.column, positions, [self.value]*len(positions))
+
+
+    def __reduce__(self):
+        return (Swap, (self.column, self.predicate, self.value))
+
+
 """
 Find an replace operation
 """
@@ -158,25 +225,17 @@ class Delete(ParametrizedOperation):
 
     def __init__(self, column, predicate):
 
-
-        logical_predicate = lambda row: (row[predicate[0]] in predicate[1]) and (tuple(row.dropna().values) in predicate[2])
-
-        #print(predicate[1])
+        self.column = column
+        self.predicate = predicate
 
         def fn(df, 
                column=column, 
-               predicate=logical_predicate):
-
-            def __internal(row):
-                if predicate(row):
-                    #print(row["4"], row["81"])
-                    return None
-                else:
-                    return row[column]
+               matches=self.matches):
 
-            df[column] = df.apply(lambda row: __internal(row), axis=1)
+            values = rowValues(df, column)
+            values[matches(df)] = None
 
-            return df
+            return writeColumn(df, column, values)
 
 
         self.name = 'df = delete(df,'+formatString(column)+','+str(predicate[0:2])+')'
@@ -185,33 +244,73 @@ class Delete(ParametrizedOperation):
         super(Delete,self).__init__(fn, ['column', 'predicate'])
 
 
+    def matches(self, df):
+        """The positions of the rows of a dataframe or an OverlayFrame that match the
+        predicate (see deleteRows)
+        """
+        return np.flatnonzero(deleteRows(df, self.predicate))
+
+
+    def onContent(self, df):
+        """The same delete of the frame where the rows of the predicate are the
+        tuples of the values of the rows that it matches, so it deletes the same
+        rows of other frames by their content
+        """
+
+        if not isinstance(self.predicate[2], pd.Index):
+            return self
+
+        positions = self.matches(df)
+        rows = set(rowTuples(df, positions))
+
+        return Delete(self.column, (self.predicate[0], self.predicate[1], rows))
+
+
+    def runOverlay(self, state):
+        positions = self.matches(state)
+        return state.withEdits(self.column, positions, [None]*len(positions))
+
+
+    def __reduce__(self):
+        return (Delete, (self.column, self.predicate))
+
+
 
 class DatetimeCast(ParametrizedOperation):
 
     paramDescriptor = {'column': ParametrizedOperation.COLUMN,
                        'form': ParametrizedOperation.SUBSTR}
 
+    #strict formats that are tried (vectorized) before dateparser
+    FORMATS = ['%m/%d/%Y %I:%M %p', '%m/%d/%Y %H:%M', '%m/%d/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+
+    #(form, text) -> the formatted date or FAILED, shared by all the casts
+    #(and blocks) of a process
+    cache = {}
+    CACHE_SIZE = 100000
+
+    FAILED = ('FAILED',)
+
 
     def __init__(self, column, form):
 
-        parser = DateDataParser(languages=['en'], allow_redetect_language=False)
+        self.column = column
+        self.form = form
+
+        self.parser = DateDataParser(languages=['en'], allow_redetect_language=False)
 
         def fn(df, 
                column=column, 
-               format=form,
-               parser=parser):
-
-            N = df.shape[0]
+               castValues=self.castValues):
 
-            for i in range(N):
-                if df[column].iloc[i] != None:
+            values = castValues(df[column].values)
 
-                    try:
-                        df[column].iloc[i] = parser.get_date_data(str(df[column].iloc[i]))['date_obj'].strftime(form)
-                    except:
-                        pass
+            #the values are written as is into a column of strings
+            if df[column].dtype == object:
+                df[column] = pd.Series(values, index=df.index, dtype=object)
+                return df
 
-            return df
+            return writeColumn(df, column, values)
 
 
         self.name = 'df = dateparse(df,'+formatString(column)+','+formatString(form)+')'
@@ -220,6 +319,110 @@ class DatetimeCast(ParametrizedOperation):
         super(DatetimeCast, self).__init__(fn, ['column', 'form'])
 
 
+    def castValue(self, value):
+        """Formats a value that parses as a date, other values are unchanged"""
+        try:
+            text = str(value)
+        except UnicodeError:
+            return value
+
+        date = self.formatAll([text])[text]
+
+        if date is DatetimeCast.FAILED:
+            return value
+
+        return date
+
+
+    def castValues(self, values):
+        """Casts an array of values, every distinct value is parsed once and
+        missing values (None) are unchanged
+        """
+        rows = {}
+
+        for i, v in enumerate(values):
+            if v != None:
+                try:
+                    rows.setdefault(str(v), []).append(i)
+                except UnicodeError:
+                    continue
+
+        dates = self.formatAll(list(rows.keys()))
+
+        result = np.empty((len(values),), dtype=object)
+        result[:] = list(values)
+
+        for text in rows:
+            if dates[text] is not DatetimeCast.FAILED:
+                result[rows[text]] = dates[text]
+
+        return result
+
+
+    def formatAll(self, texts):
+        """Returns a dict of every text to its formatted date (or FAILED). The
+        texts that aren't cached are parsed with the strict formats first, a
+        format only parses a text that it formats back to, and dateparser parses
+        the rest.
+        """
+        cache = DatetimeCast.cache
+        dates = {}
+        missing = []
+
+        for t in texts:
+            key = (self.form, t)
+            if key in cache:
+                dates[t] = cache[key]
+            else:
+                missing.append(t)
+
+        for f in unique([self.form] + DatetimeCast.FORMATS):
+
+            if len(missing) == 0:
+                break
+
+            try:
+                parsed = pd.to_datetime(pd.Series(missing), format=f, errors='coerce')
+            except (ValueError, TypeError):
+                continue
+
+            unparsed = []
+
+            for t, d in zip(missing, parsed):
+                try:
+                    if isinstance(d, datetime.datetime) and d is not pd.NaT and d.strftime(f) == t:
+                        dates[t] = d.strftime(self.form)
+                        continue
+                except ValueError:
+                    pass
+
+                unparsed.append(t)
+
+            missing = unparsed
+
+        for t in missing:
+            dates[t] = self.parse(t)
+
+        if len(cache) + len(dates) > DatetimeCast.CACHE_SIZE:
+            cache.clear()
+
+        for t in dates:
+            cache[(self.form, t)] = dates[t]
+
+        return dates
+
+
+    def parse(self, text):
+        try:
+            return self.parser.get_date_data(text)['date_obj'].strftime(self.form)
+        except:
+            return DatetimeCast.FAILED
+
+
+    def __reduce__(self):
+        return (DatetimeCast, (self.column, self.form))
+
+
 
 
 
@@ -231,32 +434,74 @@ class PatternCast(ParametrizedOperation):
 
     def __init__(self, column, form):
 
+        self.column = column
+        self.form = form
+
+        self.regex = re.compile(form)
+
         def fn(df, 
                column=column, 
-               format=form):
+               castValues=self.castValues):
 
-            N = df.shape[0]
+            values = castValues(df[column])
 
-            for i in range(N):
+            #the values are written as is into a column of strings
+            if df[column].dtype == object:
+                df[column] = pd.Series(values, index=df.index, dtype=object)
+                return df
 
-                if df[column].iloc[i] != None:
+            return writeColumn(df, column, values)
 
-                    try:
-                        df[column].iloc[i] = re.search(form, str(df[column].iloc[i])).group(0)
-                    except:
-                        df[column].iloc[i] = None
 
+        self.name = 'df = pattern(df,'+formatString(column)+','+formatString(form)+')'
+        self.provenance = [self]
 
-                if df[column].iloc[i] == '':
-                    df[column].iloc[i] = None
+        super(PatternCast, self).__init__(fn, ['column', 'form'])
 
-            return df
 
+    def castValue(self, value):
+        """The first match of the pattern in a value, None if nothing (or the empty
+        string) matches
+        """
+        if value == None:
+            return None
 
-        self.name = 'df = pattern(df,'+formatString(column)+','+formatString(form)+')'
-        self.provenance = [self]
+        try:
+            value = self.regex.search(str(value)).group(0)
+        except:
+            return None
 
-        super(PatternCast, self).__init__(fn, ['column', 'form'])
+        if value == '':
+            return None
+
+        return value
+
+
+    def castValues(self, column):
+        """Casts a column, the pattern is matched once against every distinct
+        string and missing values (None) are unchanged
+        """
+        codes, texts = pd.factorize(column.map(text))
+
+        if self.regex.groups == 0:
+            matches = pd.Series(texts, dtype=object).str.extract('(' + self.form + ')', expand=True)[0].values
+        else:
+            matches = np.array([self.castValue(t) for t in texts], dtype=object)
+
+        casts = np.empty((len(texts),), dtype=object)
+        casts[:] = [None if m != m or m == '' else m for m in matches]
+
+        values = np.empty((len(codes),), dtype=object)
+        values[:] = list(column.values)
+
+        present = codes >= 0
+        values[present] = casts[codes[present]]
+
+        return values
+
+
+    def __reduce__(self):
+        return (PatternCast, (self.column, self.form))
 
 
 
@@ -268,21 +513,12 @@ class FloatCast(ParametrizedOperation):
 
     def __init__(self, column, nrange):
 
-        def fn(df, column=column, r=nrange):
-
-            def __internal(row):
-                try:
-                    value = float(row[column])
-                    if value >= r[0] and value <= r[1]:
-                        return value
-                    else:
-                        return None 
-                except:
-                    return None
+        self.column = column
+        self.range = nrange
 
-            df[column] = df.apply(lambda row: __internal(row), axis=1)
+        def fn(df, column=column, castValues=self.castValues):
 
-            return df
+            return writeColumn(df, column, castValues(df[column]))
 
 
         self.name = 'df = numparse(df,'+formatString(column)+')'
@@ -291,6 +527,42 @@ class FloatCast(ParametrizedOperation):
         super(FloatCast, self).__init__(fn, ['column'])
 
 
+    def castValue(self, value):
+        """The value as a float, None if it isn't a float in the range"""
+        try:
+            value = float(value)
+            if value >= self.range[0] and value <= self.range[1]:
+                return value
+            else:
+                return None 
+        except:
+            return None
+
+
+    def castValues(self, column):
+        """Casts a column, every distinct value is converted once and the values
+        out of the range are None
+        """
+        if column.dtype == object:
+            codes, uniques = pd.factorize(column.values)
+            numbers = np.append(floatValues(uniques), np.nan)[codes]
+        else:
+            numbers = floatValues(column.values)
+
+        with np.errstate(invalid='ignore'):
+            inrange = (numbers >= self.range[0]) & (numbers <= self.range[1])
+
+        values = np.empty((len(numbers),), dtype=object)
+        values[:] = None
+        values[inrange] = numbers[inrange]
+
+        return values
+
+
+    def __reduce__(self):
+        return (FloatCast, (self.column, self.range))
+
+
 
 """
 No op
@@ -310,6 +582,18 @@ class NOOP(Operation):
         super(NOOP,self).__init__(fn)
 
 
+    def runOverlay(self, state):
+        return state, Delta()
+
+
+    def delta(self, before, after):
+        return Delta()
+
+
+    def __reduce__(self):
+        return (NOOP, ())
+
+
 
 
 
@@ -319,3 +603,111 @@ def formatString(s):
     return "'"+str(s)+"'"
 
 
+def unique(values):
+    """
+    The values without duplicates, in order
+    """
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+def text(value):
+    """
+    The value as a string, None for None and '' if it has no ascii string
+    """
+    if value is None:
+        return None
+
+    try:
+        return str(value)
+    except UnicodeError:
+        return ''
+
+
+def floatValues(values):
+    """
+    An array of values as floats (with float(), pd.to_numeric doesn't round
+    strings correctly), NaN for the values that aren't numbers
+    """
+    try:
+        return values.astype(float)
+    except (ValueError, TypeError):
+        return np.array([floatValue(v) for v in values], dtype=float)
+
+
+def floatValue(value):
+    try:
+        return float(value)
+    except:
+        return np.nan
+
+
+def isin(column, values):
+    """
+    A boolean array of the values of a column that are in a set of values.
+    Unlike Series.isin, values match by equality in numerical columns (pandas
+    casts the set to the type of the column, so 1.5 would match 1). NaN
+    matches NaN (any NaN, Series.isin only matches the same object) and None
+    matches None.
+    """
+    if column.dtype != object:
+        column = column.astype(object)
+
+    keys = [v for v in values if canonical(v) is not NAN_KEY]
+    matches = column.isin(keys).values
+
+    if len(keys) < len(values):
+        matches = matches | isNaN(column.values)
+
+    return matches
+
+
+def rowValues(df, column):
+    """
+    The values of a column as an object array, cast like the rows of
+    df.apply(axis=1) to a type that is common to all of the columns
+    """
+    return df[column].astype(df.iloc[:0].values.dtype).astype(object).values
+
+
+def writeColumn(df, column, values):
+    """
+    Replaces a column with an array of values and infers its type like
+    df.apply(axis=1) does
+    """
+    df[column] = pd.Series(list(values), index=df.index)
+    return df
+
+
+def rowTuples(df, positions):
+    """
+    The tuples of the non-null values of the rows at the given positions,
+    for a dataframe or an OverlayFrame
+    """
+    columns = [take(df, c, positions) for c in df.columns]
+    nulls = [pd.isnull(v) for v in columns]
+
+    return [tuple(v[k] for v, n in zip(columns, nulls) if not n[k]) for k in range(len(positions))]
+
+
+def deleteRows(df, predicate):
+    """
+    A boolean array of the rows of a dataframe or an OverlayFrame that match the
+    predicate of a delete (column, values, rows): the value of the column is one
+    of the values and the row is one of the rows. During the search the rows are
+    the index labels of the violating rows of the frame, which only refer to the
+    rows of that frame. In the programs returned by the search they are the
+    tuples of the non-null values of the rows, so only the rows whose value
+    matches are turned into tuples.
+    """
+    candidates = isin(df[predicate[0]], predicate[1])
+
+    if isinstance(predicate[2], pd.Index):
+        return candidates & df.index.isin(predicate[2])
+
+    positions = np.flatnonzero(candidates)
+
+    for i, t in zip(positions, rowTuples(df, positions)):
+        candidates[i] = t in predicate[2]
+
+    return candidates
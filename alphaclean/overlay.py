@@ -0,0 +1,369 @@
+"""
+Module: overlay
+
+An OverlayFrame is the state of the search. It is an immutable base frame plus
+a sparse overlay of cell edits, so a branch of the search costs memory in the
+number of cells it changed and not in the size of the frame. Full frames are only
+materialized when they are needed (e.g., for the winning program).
+"""
+
+import os
+import sys
+import numbers
+import itertools
+import numpy as np
+import pandas as pd
+
+from delta import Delta, sameValues, canonical
+
+
+class OverlayFrame(object):
+    """An OverlayFrame reads like a dataframe for the operations that the quality
+    functions need: shape, columns, index, and projecting columns. Neither the base
+    frame nor the edits are ever modified, new edits create a new OverlayFrame.
+    """
+
+    def __init__(self, base, edits={}, hash=0, token=None, origins={}):
+        """OverlayFrame constructor
+
+        Positional arguments:
+        base -- a dataframe that is never modified
+
+        Keyword arguments:
+        edits -- a dict mapping a column to a dict of {row position: value}
+        hash -- the content hash of the frame relative to the base
+        token -- identifies the input of the search, the frames whose base was
+                 derived from the same input share it
+        origins -- a dict mapping a (column, row position) to the cellKey of its
+                   value in the input, for the cells where the base differs from it
+        """
+
+        self.base = base
+        self.edits = edits
+
+        #states with the same content (over the same base) have the same hash
+        self.hash = hash
+        self.token = token if token is not None else uniqueToken()
+        self.origins = origins
+
+        self.contentKey = None
+
+        self.shape = base.shape
+        self.columns = base.columns
+        self.index = base.index
+
+        #columns with the edits applied
+        self.materialized = {}
+
+
+    def __getitem__(self, key):
+        """Projects the frame onto a column (a Series) or a list of columns (a DataFrame)
+        """
+
+        if isinstance(key, list):
+            return pd.DataFrame(dict((k, self[k]) for k in key), index=self.index, columns=key)
+
+        if key not in self.edits:
+            return self.base[key]
+
+        if key not in self.materialized:
+            column = self.base[key].copy()
+            positions, values = self._edits(key)
+
+            #a list of mixed values would be cast to strings, so values that a
+            #numerical column can't hold as numbers make it an object column
+            if column.dtype != object and self.castsColumn(key, values) and \
+               not all(fitsKind(v, 'f') for v in values):
+                column = column.astype(object)
+
+            if column.dtype == object:
+                objects = np.empty((len(values),), dtype=object)
+                objects[:] = values
+                values = objects
+
+            column.iloc[positions] = values
+            self.materialized[key] = column
+
+        return self.materialized[key]
+
+
+    def take(self, column, positions):
+        """Returns the values of a column at an array of row positions"""
+
+        values = self.base[column].values[positions]
+
+        if column not in self.edits:
+            return values
+
+        edits = self.edits[column]
+        values = values.astype(object)
+
+        for k, i in enumerate(positions):
+            if i in edits:
+                values[k] = edits[i]
+
+        return values
+
+
+    def withEdits(self, column, positions, values):
+        """Returns a new OverlayFrame with the values written to the column at the row
+        positions, and the Delta of the cells that changed.
+
+        Positional arguments:
+        column -- a column name
+        positions -- an array of row positions
+        values -- an array of values aligned with the positions
+        """
+
+        #the values are read back as the materialized column holds them
+        kind = self.base[column].dtype.kind
+
+        if kind != 'O':
+            values = np.array([numericalValue(v, kind) for v in values], dtype=object)
+        else:
+            values = np.array(values, dtype=object)
+
+        old = self.take(column, positions)
+        changed = ~sameValues(old.astype(object), values)
+
+        positions = np.asarray(positions)[changed]
+
+        if len(positions) == 0:
+            return self, Delta()
+
+        values = values[changed]
+        old = old[changed]
+
+        edits = dict(self.edits)
+        edits[column] = dict(self.edits.get(column, {}))
+        edits[column].update(zip(positions, values))
+
+        return OverlayFrame(self.base, edits, updateHash(self.hash, column, positions, old, values),
+                            self.token, self.origins), \
+               Delta({column: positions}, {column: old})
+
+
+    def castsColumn(self, column, values):
+        """Returns true if writing the values to the column could change its dtype
+        (values that a numerical column can't hold, e.g., None into ints or
+        strings into floats)
+        """
+
+        kind = self.base[column].dtype.kind
+
+        if kind == 'O':
+            return False
+
+        return not all(fitsKind(v, kind) for v in values)
+
+
+    def rebase(self, frame, delta):
+        """Returns an OverlayFrame with frame as its base, where frame is this frame
+        after the changes in the delta (None if the changes are unknown)
+        """
+
+        if delta is None:
+            return OverlayFrame(frame, {}, uniqueHash())
+
+        h = self.hash
+        for column in delta.cells:
+            positions = delta.cells[column]
+            h = updateHash(h, column, positions, delta.old[column], frame[column].values[positions])
+
+        #the edits and the changes are now in the base, remember the input values
+        #of those cells so the content is still relative to the input
+        origins = dict(self.origins)
+        for cells in (self.edits, delta.cells):
+            for column in cells:
+                positions = np.array(sorted(cells[column]), dtype=int)
+
+                for i, v in zip(positions, self.base[column].values[positions]):
+                    if (column, i) not in origins:
+                        origins[(column, i)] = cellKey(v)
+
+        return OverlayFrame(frame, {}, h, self.token, origins)
+
+
+    def key(self):
+        """The content of the frame as a StateKey, the cells that differ from the
+        input of the search (by value and by type)
+        """
+
+        if self.contentKey is None:
+            positions = {}
+            for column in self.edits:
+                positions[column] = set(self.edits[column])
+            for column, i in self.origins:
+                positions.setdefault(column, set()).add(i)
+
+            cells = []
+            for column in positions:
+                edits = self.edits.get(column, {})
+                rows = np.array(sorted(positions[column]), dtype=int)
+
+                for i, b in zip(rows, self.base[column].values[rows]):
+                    k = cellKey(edits[i] if i in edits else b)
+
+                    #a cell that was changed back to its input value is unchanged
+                    if k != self.origins.get((column, i), cellKey(b)):
+                        cells.append((column, i, k))
+
+            self.contentKey = StateKey(self.hash, self.token, frozenset(cells))
+
+        return self.contentKey
+
+
+    def materialize(self):
+        """Returns a new dataframe with the edits applied"""
+
+        df = self.base.copy()
+
+        for column in self.edits:
+            df[column] = self[column]
+
+        return df
+
+
+    def memoryUsage(self):
+        """An estimate of the bytes held by the edits (the base frame is shared)"""
+        return sum(sys.getsizeof(e) + sum(sys.getsizeof(v) for v in e.values()) for e in self.edits.values())
+
+
+    def _edits(self, column):
+        edits = self.edits[column]
+        positions = np.array(sorted(edits.keys()), dtype=int)
+        return positions, [edits[i] for i in positions]
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+
+def numericalValue(value, kind):
+    """A value as it reads once written to a numerical column of a dtype kind:
+    missing values are NaN and the numbers of a float column are floats
+    """
+
+    if value is None:
+        return np.nan
+
+    if kind == 'f' and isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_)):
+        return float(value)
+
+    return value
+
+
+
+def fitsKind(value, kind):
+    """Returns true if a numerical column of a dtype kind holds the value as is"""
+
+    if isinstance(value, (bool, np.bool_)):
+        return kind == 'b'
+
+    if kind == 'f':
+        return isinstance(value, numbers.Real)
+
+    if kind in 'iu':
+        return isinstance(value, numbers.Integral)
+
+    return False
+
+
+
+class StateKey(object):
+    """The content of an OverlayFrame as a key of a dict or a set. A key hashes
+    like the content hash of its frame, and two keys are only equal if their
+    frames derive from the same input and the same cells differ from it, so
+    frames whose hashes collide are told apart. Only the content is compared, frames
+    that different programs produced are equal if their cells are.
+    """
+
+    def __init__(self, hash, token, cells):
+        self.hash = hash
+        self.token = token
+        self.cells = cells
+
+
+    def __hash__(self):
+        return self.hash
+
+
+    def __eq__(self, other):
+        return isinstance(other, StateKey) and self.hash == other.hash and \
+               self.token == other.token and self.cells == other.cells
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+
+def cellKey(value):
+    """A hashable key of a cell value that tells apart the values that python
+    compares and hashes as equal (1, 1.0 and True), numpy and python numbers of
+    the same kind have the same key and every NaN has the same key
+    """
+
+    #the kind is a name so that keys can be pickled
+    if isinstance(value, (bool, np.bool_)):
+        kind = 'bool'
+    elif isinstance(value, numbers.Integral):
+        kind = 'int'
+    elif isinstance(value, numbers.Real):
+        kind = 'float'
+    else:
+        kind = type(value).__module__ + '.' + type(value).__name__
+
+    value = canonical(value)
+
+    try:
+        hash(value)
+    except TypeError:
+        value = str(value)
+
+    return (kind, value)
+
+
+
+#the hash is a Zobrist hash: the xor of a hash of every edited cell before
+#and after its edit, editing a cell back to its old value cancels out
+def cellHash(column, position, value):
+    return hash((column, position, cellKey(value)))
+
+
+def updateHash(h, column, positions, old, new):
+    """Updates a hash with the cells of a column at the positions changing from
+    the old values to the new values
+    """
+
+    for i, a, b in zip(positions, old, new):
+        h ^= cellHash(column, i, a) ^ cellHash(column, i, b)
+
+    return h
+
+
+_unique_hashes = itertools.count(1)
+
+def uniqueHash():
+    """A hash that (with high probability) doesn't equal the hash of any other state"""
+    return hash(('unique', next(_unique_hashes)))
+
+
+_unique_tokens = itertools.count(1)
+
+def uniqueToken():
+    """A token that no other base has, in any process"""
+    return (os.getpid(), next(_unique_tokens))
+
+
+
+def take(df, column, positions):
+    """Returns the values of a column at an array of row positions for a dataframe
+    or an OverlayFrame
+    """
+
+    if isinstance(df, OverlayFrame):
+        return df.take(column, positions)
+
+    return df[column].values[positions]
@@ -0,0 +1,286 @@
+"""
+Module: profiling
+
+The search reports what it does to a Tracer: the start and the end of blocks and
+search levels, what happens to every branch, and how long the sampler, the
+operations and the quality functions take. The default tracer ignores all of it.
+A Profiler records counters, timers and a trace that can be saved as JSON or in
+the Chrome trace format (open it in chrome://tracing).
+"""
+
+import json
+import time
+
+
+class Tracer(object):
+    """A tracer receives the events of the search, every hook does nothing. A subclass
+    overrides the hooks that it is interested in.
+    """
+
+    def blockStart(self, block, key, size):
+        pass
+
+    def blockEnd(self, block, key):
+        pass
+
+    def levelStart(self, depth, value):
+        pass
+
+    def levelEnd(self, depth, branches):
+        pass
+
+    def branchGenerated(self, depth, l, op):
+        pass
+
+    def branchPruned(self, depth, l, op, reason):
+        pass
+
+    def branchEvaluated(self, depth, l, op, value):
+        pass
+
+    def branchPromoted(self, depth, l, op, value):
+        pass
+
+
+    def timer(self, name):
+        """Returns a context manager that times the block of code it runs"""
+        return NULL_TIMER
+
+
+    def stopwatch(self):
+        """Returns a Stopwatch for the work of one branch, which can run in a
+        worker process. The times are added back with addTimes.
+        """
+        return NULL_STOPWATCH
+
+
+    def addTimes(self, times):
+        pass
+
+
+    def fork(self, lane):
+        """Returns the tracer for the work of a block, which can run in a worker
+        process. The tracer is merged back with join.
+        """
+        return self
+
+
+    def join(self, tracer):
+        pass
+
+
+
+class Timer(object):
+    """A context manager that adds the time it was open to a dict of times"""
+
+    def __init__(self, times, name, callback=None):
+        self.times = times
+        self.name = name
+        self.callback = callback
+
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+
+    def __exit__(self, *args):
+        elapsed = time.time() - self.start
+        seconds, calls = self.times.get(self.name, (0.0, 0))
+        self.times[self.name] = (seconds + elapsed, calls + 1)
+
+        if self.callback != None:
+            self.callback(self.name, self.start, elapsed)
+
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+
+class Stopwatch(object):
+    """Accumulates named times in a plain dict that can be sent between processes"""
+
+    def __init__(self):
+        self.times = {}
+
+
+    def timer(self, name):
+        return Timer(self.times, name)
+
+
+
+class NullStopwatch(object):
+
+    times = None
+
+    def timer(self, name):
+        return NULL_TIMER
+
+
+
+NULL_TIMER = NullTimer()
+NULL_STOPWATCH = NullStopwatch()
+NULL_TRACER = Tracer()
+
+
+
+class Profiler(Tracer):
+    """A profiler counts the events of the search, times its phases, and records
+    a trace of the blocks, the levels and the timed phases of every level.
+    """
+
+    def __init__(self, branches=False, lane=0, epoch=None):
+        """Profiler constructor
+
+        Keyword arguments:
+        branches -- also trace every branch (this can be a very large trace)
+        lane -- the trace lane (thread id in the Chrome format) of the events
+        epoch -- the time.time() at which the trace starts
+        """
+
+        self.branches = branches
+        self.lane = lane
+        self.epoch = epoch or time.time()
+
+        self.counters = {}
+        self.timers = {}
+        self.events = []
+
+        self.starts = {}
+
+
+    def count(self, name, k=1):
+        self.counters[name] = self.counters.get(name, 0) + k
+
+
+    def blockStart(self, block, key, size):
+        self.count('blocks')
+        self.starts['block'] = time.time()
+
+
+    def blockEnd(self, block, key):
+        self.span('block ' + str(block), 'block', self.starts.pop('block'), {'key': str(key)})
+
+
+    def levelStart(self, depth, value):
+        self.count('levels')
+        self.starts['level'] = time.time()
+        self.levelValue = value
+
+
+    def levelEnd(self, depth, branches):
+        self.span('level ' + str(depth), 'level', self.starts.pop('level'),
+                  {'value': self.levelValue, 'branches': branches})
+
+
+    def branchGenerated(self, depth, l, op):
+        self.count('branches.generated')
+
+
+    def branchPruned(self, depth, l, op, reason):
+        self.count('branches.' + reason)
+
+        if self.branches:
+            self.instant('pruned', 'branch', {'depth': depth, 'branch': l, 'op': op.name, 'reason': reason})
+
+
+    def branchEvaluated(self, depth, l, op, value):
+        self.count('branches.evaluated')
+
+        if self.branches:
+            self.instant('evaluated', 'branch', {'depth': depth, 'branch': l, 'op': op.name, 'value': value})
+
+
+    def branchPromoted(self, depth, l, op, value):
+        self.count('branches.promoted')
+        self.instant('promoted', 'branch', {'depth': depth, 'branch': l, 'op': op.name, 'value': value})
+
+
+    def timer(self, name):
+        return Timer(self.timers, name, self.timed)
+
+
+    def stopwatch(self):
+        return Stopwatch()
+
+
+    def addTimes(self, times):
+        for name in times:
+            seconds, calls = self.timers.get(name, (0.0, 0))
+            self.timers[name] = (seconds + times[name][0], calls + times[name][1])
+
+
+    def fork(self, lane):
+        return Profiler(self.branches, lane, self.epoch)
+
+
+    def join(self, tracer):
+        for name in tracer.counters:
+            self.count(name, tracer.counters[name])
+
+        self.addTimes(tracer.timers)
+        self.events.extend(tracer.events)
+
+
+    def timed(self, name, start, elapsed):
+        self.events.append(self.event(name, 'timer', 'X', start, {}, elapsed))
+
+
+    def span(self, name, category, start, args):
+        self.events.append(self.event(name, category, 'X', start, args, time.time() - start))
+
+
+    def instant(self, name, category, args):
+        e = self.event(name, category, 'i', time.time(), args)
+        e['s'] = 't'
+        self.events.append(e)
+
+
+    def event(self, name, category, phase, start, args, elapsed=None):
+        #the chrome format is in microseconds
+        e = {'name': name, 'cat': category, 'ph': phase, 'pid': 0, 'tid': self.lane,
+             'ts': int((start - self.epoch)*1e6), 'args': args}
+
+        if elapsed != None:
+            e['dur'] = int(elapsed*1e6)
+
+        return e
+
+
+    def summary(self):
+        """Returns the counters and the timers (total seconds and calls) as a dict"""
+        return {'counters': dict(self.counters),
+                'timers': dict((k, {'seconds': s, 'calls': c}) for k, (s, c) in self.timers.items())}
+
+
+    def save(self, filename, format='chrome'):
+        """Saves the trace to a file
+
+        Positional arguments:
+        filename -- the file to write
+
+        Keyword arguments:
+        format -- 'chrome' for the Chrome trace format or 'json' for the summary and the events
+        """
+
+        if format == 'chrome':
+            trace = {'traceEvents': sorted(self.events, key=lambda e: e['ts']),
+                     'displayTimeUnit': 'ms',
+                     'otherData': self.summary()}
+
+        elif format == 'json':
+            trace = self.summary()
+            trace['events'] = self.events
+
+        else:
+            raise ValueError('Unknown trace format: ' + str(format))
+
+        with open(filename, 'w') as f:
+            json.dump(trace, f, default=str)
@@ -8,12 +8,19 @@ consistent,  whereas \gamma=  1  is  a  pure  greedy search.
 """
 
 import numpy as np
+import pandas as pd
 import datetime
+import time
 
 from generators import *
 from heapq import *
 
 from alphaclean.learning import *
+from alphaclean.executors import *
+from alphaclean.profiling import NULL_TRACER
+from alphaclean.overlay import OverlayFrame
+from alphaclean.word2vec import loadWord2Vec
+from alphaclean.candidates import Candidates
 
 #special case optimizations require references to the pattern objects
 from alphaclean.constraint_languages.pattern import *
@@ -22,13 +29,22 @@ from alphaclean.constraint_languages.pattern import *
 #Configuration schema
 DEFAULT_SOLVER_CONFIG = {}
 
+DEFAULT_FRONTIER_SIZE = 64
+
 DEFAULT_SOLVER_CONFIG['pattern'] = {
     'depth': 10,
     'gamma': 5,
     'edit': 1,
     'operations': [Delete],
     'similarity': {},
-    'w2v': 'resources/GoogleNews-vectors-negative300.bin'
+    'w2v': 'resources/GoogleNews-vectors-negative300.bin',
+    'executor': 'serial',
+    'workers': None,
+    'frontier': DEFAULT_FRONTIER_SIZE,
+    'frontier_memory': None,
+    'codebook_k': None, #the number of nearest codebook values proposed for a dirty value (None is all)
+    'candidate_distance': None, #the largest edit cost of the values of a column proposed for a dirty value (None is all)
+    'operation_budget': None #the number of operations generated per search level, those covering the most violations (None is all)
 }
 
 DEFAULT_SOLVER_CONFIG['dependency'] = {
@@ -37,12 +53,32 @@ DEFAULT_SOLVER_CONFIG['dependency'] = {
     'edit': 1,
     'operations': [Swap],
     'similarity': {},
-    'w2v': 'resources/GoogleNews-vectors-negative300.bin'
+    'w2v': 'resources/GoogleNews-vectors-negative300.bin',
+    'executor': 'serial',
+    'workers': None,
+    'frontier': DEFAULT_FRONTIER_SIZE,
+    'frontier_memory': None,
+    'codebook_k': None, #the number of nearest codebook values proposed for a dirty value (None is all)
+    'candidate_distance': None, #the largest edit cost of the values of a column proposed for a dirty value (None is all)
+    'operation_budget': None #the number of operations generated per search level, those covering the most violations (None is all)
+}
+
+DEFAULT_SOLVER_CONFIG['blocks'] = {
+    'executor': 'serial',
+    'workers': None
+}
+
+#wall-clock budgets in seconds, when a budget runs out the search returns the best program so far
+DEFAULT_SOLVER_CONFIG['budget'] = {
+    'total': None,
+    'block': None,
+    'constraint': None,
+    'patience': None #node expansions without an improvement before a search stops
 }
 
 
 
-def solve(df, patterns=[], dependencies=[], partitionOn=None, config=DEFAULT_SOLVER_CONFIG):
+def solve(df, patterns=[], dependencies=[], partitionOn=None, config=DEFAULT_SOLVER_CONFIG, tracer=NULL_TRACER):
     """The solve function takes as input a specification in terms of a list of patterns and 
     a list of depdencies and returns a cleaned instance and a data cleaning program.
 
@@ -54,78 +90,92 @@ def solve(df, patterns=[], dependencies=[], partitionOn=None, config=DEFAULT_SOL
     dependencies -- a list of single or multiple attribute constraints that are run after the pattern constraints
     patitionOn -- a blocking rule to partition the dataset
     config -- a config object
+    tracer -- a Tracer that receives the events of the search (see the profiling module)
     """
 
     op = NOOP()
 
     logging.debug('Starting the search algorithm with the following config: ' + str(df.shape) + " " + str(config))
 
+    budget = config.get('budget', {})
+    deadline = deadlineAfter(budget.get('total'))
 
-    if needWord2Vec(config):
-        w2vp = loadWord2Vec(config['pattern']['w2v'])
-        w2vd = loadWord2Vec(config['pattern']['w2v'])
 
-        logging.debug('Using word2vec for semantic similarity')
+    #the phases share a model if they use the same file
+    for phase in ['pattern', 'dependency']:
 
-    else:
-        w2vp = None
-        w2vd = None
+        if needWord2Vec(config[phase]):
+            logging.debug('Using word2vec for semantic similarity in the ' + phase + ' constraints')
+            config[phase]['model'] = loadWord2Vec(config[phase]['w2v'])
 
-    config['pattern']['model'] = w2vp
-    config['dependency']['model'] = w2vd
+        else:
+            config[phase]['model'] = None
 
     training_set = (set(), set())
     pruningModel = None
 
     if partitionOn != None:
-        
-        
-        logging.warning("You didn't specify any blocking rules, this might be slow")
 
+        blocks = partitionBlocks(df, partitionOn)
 
-        blocks = set(df[partitionOn].dropna().values)
+        def solveBlock(b, pruningModel=pruningModel):
+            i, key, positions = b
 
-        #df = df.set_index(partitionOn)
+            logging.info("Computing Block=" + str(key) + ' ' + str(i+1)  + " out of " + str(len(blocks)) )
 
-        for i, b in enumerate(blocks):
+            print("Computing Block=" + str(key) + ' ' + str(i+1)  + " out of " + str(len(blocks)))
 
-            
-            logging.info("Computing Block=" + str(b) + ' ' + str(i+1)  + " out of " + str(len(blocks)) )
+            dfc = df.iloc[positions].copy()
 
-            print("Computing Block=" + str(b) + ' ' + str(i+1)  + " out of " + str(len(blocks)))
+            logging.debug("Block=" + str(key) + ' size=' + str(dfc.shape[0]))
 
+            #blocks can run in other processes, their events are merged after the map
+            block_tracer = tracer.fork(i)
+            block_tracer.blockStart(i, key, dfc.shape[0])
 
-            dfc = df.loc[ df[partitionOn] == b ].copy()
+            block_deadline = deadlineAfter(budget.get('block'), deadline)
 
-            logging.debug("Block=" + str(b) + ' size=' + str(dfc.shape[0]))
+            op1, dfc = patternConstraints(dfc, patterns, config['pattern'], budget, block_deadline, block_tracer)
 
+            op2, output_block, training = dependencyConstraints(dfc, dependencies, config['dependency'], pruningModel, \
+                                                                budget, block_deadline, block_tracer)
 
-            op1, dfc = patternConstraints(dfc, patterns, config['pattern'])
-            
-            op2, output_block, training = dependencyConstraints(dfc, dependencies, config['dependency'], pruningModel)
+            block_tracer.blockEnd(i, key)
 
-            #update output block
-            now = datetime.datetime.now()
-            df.loc[ df[partitionOn] == b ] = output_block 
-            print((datetime.datetime.now()-now).total_seconds())
+            return (op1 * op2, output_block, training, block_tracer)
 
-            training_set = (training_set[0].union(training[0]), training_set[1].union(training[1]))
 
+        blockConfig = config.get('blocks', {})
+        executor = getExecutor(blockConfig.get('executor', 'serial'), blockConfig.get('workers'))
+
+        #largest blocks first so that no worker is left with a big block at the end
+        schedule = scheduleBlocks(blocks)
+        results = executor.map(solveBlock, schedule, chunksize=1)
+        results = dict(zip([b[0] for b in schedule], results))
 
-            #pruningModel = getFeatures(training_set[0], training_set[1], df)
+        #merge the blocks back in a fixed order
+        output_blocks = []
 
-            #if len(training_set[0]) > 10000:
-            #    exit()
+        for i, key, positions in blocks:
+            block_op, output_block, training, block_tracer = results[i]
 
+            tracer.join(block_tracer)
 
+            output_blocks.append(output_block)
+
+            training_set = (training_set[0].union(training[0]), training_set[1].union(training[1]))
 
-            op = op * (op1 * op2)
+            op = op * block_op
+
+        df = mergeBlocks(df, blocks, output_blocks)
 
     else:
+
+        logging.warning("You didn't specify any blocking rules, this might be slow")
        
-        op1, df = patternConstraints(df, patterns, config['pattern'])
+        op1, df = patternConstraints(df, patterns, config['pattern'], budget, deadline, tracer)
 
-        op2, df = dependencyConstraints(df, dependencies, config['dependency'])
+        op2, df, _ = dependencyConstraints(df, dependencies, config['dependency'], None, budget, deadline, tracer)
 
         op = op * (op1*op2)
 
@@ -133,29 +183,69 @@ def solve(df, patterns=[], dependencies=[], partitionOn=None, config=DEFAULT_SOL
 
 
 
-def loadWord2Vec(filename):
-    """Loads a word2vec model from a file"""
-    from gensim.models.keyedvectors import KeyedVectors
-    return KeyedVectors.load_word2vec_format(filename, binary=True)
+def partitionBlocks(df, partitionOn):
+    """Splits the frame into blocks with a single groupby. Returns a list of 
+    (block number, key, row positions) in the order the keys first appear.
+
+    Positional arguments:
+    df -- Pandas DataFrame
+    partitionOn -- a blocking rule to partition the dataset
+    """
+
+    indices = df.groupby(partitionOn, sort=False).indices
+
+    keys = sorted(indices.keys(), key=lambda k: indices[k][0])
+
+    return [(i, k, indices[k]) for i, k in enumerate(keys)]
+
+
+
+def scheduleBlocks(blocks):
+    """Orders blocks largest first, ties are broken by the block number"""
+    return sorted(blocks, key=lambda b: (-len(b[2]), b[0]))
+
+
+
+def mergeBlocks(df, blocks, output_blocks):
+    """Puts the output blocks back in the row order of the input frame, rows
+    that are not in any block (e.g., a missing partition key) are unchanged.
+    """
+
+    positions = [b[2] for b in blocks]
+    covered = np.zeros((df.shape[0],), dtype=bool)
+
+    for p in positions:
+        covered[p] = True
+
+    rest = np.flatnonzero(~covered)
+
+    merged = pd.concat(output_blocks + [df.iloc[rest]])
+    order = np.concatenate(positions + [rest])
+
+    return merged.iloc[np.argsort(order, kind='mergesort')]
 
 
 
 def needWord2Vec(config):
-    """Determines whether word2vec is needed"""
-    semantic_in_pattern = 'semantic' in [config['pattern']['similarity'][k] for k in config['pattern']['similarity']]
-    semantic_in_dependency = 'semantic' in [config['dependency']['similarity'][k] for k in config['dependency']['similarity']]
-    return semantic_in_pattern or semantic_in_dependency
+    """Determines whether word2vec is needed by a phase (the config of the pattern
+    or the dependency constraints)
+    """
+    return 'semantic' in [config['similarity'][k] for k in config['similarity']]
 
 
 
 
-def patternConstraints(df, costFnList, config):
+def patternConstraints(df, costFnList, config, budget={}, deadline=None, tracer=NULL_TRACER):
     """Enforces pattern constrains"""
 
     op = NOOP()
 
     for c in costFnList:
 
+        if expired(deadline):
+            logging.warning('Out of time, skipping pattern constraint='+str(c))
+            continue
+
         logging.debug('Enforcing pattern constraint='+str(c))
 
         if isinstance(c,Date):
@@ -175,7 +265,16 @@ def patternConstraints(df, costFnList, config):
 
         transform, df, _ = treeSearch(df, c, config['operations'], evaluations=config['depth'], \
                                    inflation=config['gamma'], editCost=config['edit'], similarity=config['similarity'],\
-                                    word2vec=config['model'])
+                                    word2vec=config['model'],
+                                    executor=getExecutor(config.get('executor', 'serial'), config.get('workers')),
+                                    frontierSize=config.get('frontier', DEFAULT_FRONTIER_SIZE),
+                                    frontierMemory=config.get('frontier_memory'),
+                                    codebookK=config.get('codebook_k'),
+                                    candidateDistance=config.get('candidate_distance'),
+                                    operationBudget=config.get('operation_budget'),
+                                    deadline=deadlineAfter(budget.get('constraint'), deadline),
+                                    patience=budget.get('patience'),
+                                    tracer=tracer)
 
         op = op * transform
 
@@ -183,19 +282,33 @@ def patternConstraints(df, costFnList, config):
     return op, df
 
 
-def dependencyConstraints(df, costFnList, config, pruningModel=None):
+def dependencyConstraints(df, costFnList, config, pruningModel=None, budget={}, deadline=None, tracer=NULL_TRACER):
     """enforces dependency constraints"""
 
     op = NOOP()
+    training = (set(), set())
 
     for c in costFnList:
 
+        if expired(deadline):
+            logging.warning('Out of time, skipping dependency constraint='+str(c))
+            continue
+
         logging.debug('Enforcing dependency constraint='+str(c))
 
         transform, df, training = treeSearch(df, c, config['operations'], evaluations=config['depth'], \
                                    inflation=config['gamma'], editCost=config['edit'], similarity=config['similarity'],\
                                     word2vec=config['model'],
-                                    pruningModel=pruningModel)
+                                    pruningModel=pruningModel,
+                                    executor=getExecutor(config.get('executor', 'serial'), config.get('workers')),
+                                    frontierSize=config.get('frontier', DEFAULT_FRONTIER_SIZE),
+                                    frontierMemory=config.get('frontier_memory'),
+                                    codebookK=config.get('codebook_k'),
+                                    candidateDistance=config.get('candidate_distance'),
+                                    operationBudget=config.get('operation_budget'),
+                                    deadline=deadlineAfter(budget.get('constraint'), deadline),
+                                    patience=budget.get('patience'),
+                                    tracer=tracer)
 
         op = op * transform
 
@@ -205,7 +318,10 @@ def dependencyConstraints(df, costFnList, config, pruningModel=None):
 
 
 def treeSearch(df, costFn, operations, evaluations, inflation, editCost,
-               similarity, word2vec, pruningModel=None):
+               similarity, word2vec, pruningModel=None, executor=None,
+               frontierSize=DEFAULT_FRONTIER_SIZE, frontierMemory=None, codebookK=None, candidateDistance=None,
+               operationBudget=None, deadline=None, patience=None,
+               tracer=NULL_TRACER):
     """This is the function that actually runs the treesearch
 
     Positional arguments:
@@ -217,16 +333,51 @@ def treeSearch(df, costFn, operations, evaluations, inflation, editCost,
     editCost -- scaling on the edit cost
     similarity -- a dictionary the specified similarity metrics to use
     word2vec -- a word2vec model (avoid reloading things)
+
+    Keyword arguments:
+    pruningModel -- a learned model to prune branches
+    executor -- an Executor that scores the branches of a level (defaults to serial)
+    frontierSize -- the maximum number of nodes on the frontier
+    frontierMemory -- the maximum estimated bytes of the search states on the frontier (None is unbounded)
+    codebookK -- the number of nearest codebook values that are swapped in for a dirty value (None is all of them)
+    candidateDistance -- the largest edit cost of the values of a column that are swapped in for a dirty value
+                         of the same column (None is all of them)
+    operationBudget -- the number of operations generated per level, the ones whose predicates cover the
+                       most violations (None is all of them, in the order of the parameter grid)
+    deadline -- a time.time() after which the search returns the best program so far
+    patience -- the number of node expansions without an improvement before the search stops
+    tracer -- a Tracer that receives the events of the search
+
+    A branch whose data equals the data of a state that was already scored is
+    skipped. The states are compared by content only (the cells that differ from
+    the input, by value and by type), not by the programs that produced them.
     """
 
-    editCostObj = CellEdit(df.copy(), similarity, word2vec)
+    if executor is None:
+        executor = SerialExecutor()
+
+    if expired(deadline):
+        logging.warning('Out of time, not searching constraint=' + str(costFn))
+        return NOOP(), df, (set(), set())
+
+    #the copy is the immutable base of every search state
+    source = df.copy()
+
+    editCostObj = CellEdit(source, similarity, word2vec)
     efn = editCostObj.qfn
 
-    best = (2.0, NOOP(), df)
+    candidates = Candidates(editCostObj, codebookK, candidateDistance)
 
-    branch_hash = set()
-    branch_value = hash(str(df.values))
-    branch_hash.add(branch_value)
+    root = SearchNode(None, NOOP(), OverlayFrame(source))
+    root.value, root.quality, root.scores = rootValue(source, costFn, efn, editCost, tracer)
+
+    best = root
+    frontier = Frontier(frontierSize, frontierMemory)
+    frontier.push(root)
+
+    #transposition table of the states already scored, the states are looked
+    #up by their content hash and a hit is confirmed by comparing their content
+    transpositions = set([root.state.key()])
 
     bad_op_cache = set()
 
@@ -234,69 +385,337 @@ def treeSearch(df, costFn, operations, evaluations, inflation, editCost,
 
     all_operations = set()
 
+    #expansions since the incumbent last improved
+    stale = 0
+
 
     for i in range(evaluations):
 
+        if len(frontier) == 0:
+            break
+
+        #anytime search, stop early and return the incumbent
+        if best.quality == 0:
+            logging.debug('Search satisfied the constraint after ' + str(i) + ' expansions')
+            break
+
+        if expired(deadline):
+            logging.warning('Search ran out of time after ' + str(i) + ' expansions')
+            break
+
+        if patience != None and stale >= patience:
+            logging.debug('Search stopped improving after ' + str(i) + ' expansions')
+            break
+
+        stale = stale + 1
+
         level_start_time = datetime.datetime.now()
 
         logging.debug('Search Depth='+str(i))
         
-        value, op, frame = best 
+        node = frontier.pop()
+        value, op, frame = node.value, node.op, node.realize()
 
-        #prune
-        if (value-op.depth) > best[0]*inflation:
+        #prune nodes that are more than gamma times worse than the incumbent
+        if value > best.value*inflation:
+            logging.debug('Pruned Search Node=' + str(value))
             continue
 
-        bfs_source = frame.copy()
+        tracer.levelStart(i, value)
 
-        p = ParameterSampler(bfs_source, costFn, operations, editCostObj)
+        bfs_source = frame.materialize()
 
-        costEval = costFn.qfn(bfs_source)
-        
-        for l, opbranch in enumerate(p.getAllOperations()):
+        #branches are scored incrementally from the scores of the level's source
+        if node.scores != None:
+            costEval, editEval = node.scores
+        else:
+            with tracer.timer('quality-fn'):
+                costEval = costFn.qfn(bfs_source)
 
-            logging.debug('Search Branch='+str(l)+' ' + opbranch.name)
+            with tracer.timer('edit-cost'):
+                editEval = efn(bfs_source)
 
-            if not isinstance(opbranch, NOOP):
-                all_operations.add(opbranch)
+        #generating and scoring a level can take a while on large instances
+        if expired(deadline):
+            logging.warning('Search ran out of time after ' + str(i) + ' expansions')
+            tracer.levelEnd(i, 0)
+            break
 
-            #prune bad ops
-            if opbranch.name in bad_op_cache:
-                continue
+        branches = []
+
+        with tracer.timer('sampler'):
+
+            p = ParameterSampler(bfs_source, costFn, operations, editCostObj, scores=costEval, candidates=candidates)
+
+            for l, opbranch in enumerate(p.iterOperations(operationBudget)):
+
+                tracer.branchGenerated(i, l, opbranch)
+
+                if not isinstance(opbranch, NOOP):
+                    all_operations.add(opbranch)
+
+                #prune bad ops
+                if opbranch.name in bad_op_cache:
+                    tracer.branchPruned(i, l, opbranch, BRANCH_ERROR)
+                    continue
+
+                #if pruningModel != None and not predict(pruningModel, opbranch, df):
+                #    #print("Pruned: ", opbranch)
+                #    continue
 
-            #if pruningModel != None and not predict(pruningModel, opbranch, df):
-            #    #print("Pruned: ", opbranch)
-            #    continue
+                branches.append((l, opbranch))
 
-            nextop = op * opbranch
+        if expired(deadline):
+            logging.warning('Search ran out of time after ' + str(i) + ' expansions')
+            tracer.levelEnd(i, 0)
+            break
+
+        #the lowest numbered branch of each new state in this level
+        claimed = {}
+
+
+        def scoreBranch(branch, watch, frame=frame, keepOutput=executor.sharesMemory):
+            l, opbranch = branch
+
+            if expired(deadline):
+                return BRANCH_TIMEOUT
+
+            logging.debug('Search Branch='+str(l)+' ' + opbranch.name)
 
             #disallow trasforms that cause an error
             try:
-                output = opbranch.run(frame)
+                with watch.timer('op-run'):
+                    output, delta = opbranch.runOverlay(frame)
             except:
                 logging.warn('Error in Search Branch='+str(l)+' ' + opbranch.name)
-                bad_op_cache.add(opbranch.name)
-                continue
-
-            editfn = np.sum(efn(output))
+                return BRANCH_ERROR
 
             #evaluate pruning
             if pruningRules(output):
                 logging.debug('Pruned Search Branch='+str(l)+' ' + opbranch.name)
+                return BRANCH_PRUNED
+
+            #skip states that were already scored (the transposition table is
+            #read only while the level runs)
+            key = output.key()
+
+            if key in transpositions or claimed.setdefault(key, l) < l:
+                logging.debug('Duplicate Search Branch='+str(l)+' ' + opbranch.name)
+                return BRANCH_DUPLICATE
+
+            #disallow states that can't be scored
+            try:
+                with watch.timer('edit-cost'):
+                    if delta is None:
+                        editfn = np.sum(efn(output))
+                    else:
+                        editfn = np.sum(editCostObj.qfnDelta(output, editEval, delta))
+
+                with watch.timer('quality-fn'):
+                    if delta is None:
+                        branchEval = costFn.qfn(output)
+                    else:
+                        branchEval = costFn.qfnDelta(output, costEval, delta)
+            except:
+                logging.warn('Error in Scoring Search Branch='+str(l)+' ' + opbranch.name)
+                return BRANCH_ERROR
+
+            n = (np.sum(branchEval) + editCost*editfn)/output.shape[0]
+            q = np.sum(branchEval)/output.shape[0]
+
+            if keepOutput:
+                return (n, output, key, q)
+            else:
+                return (n, None, key, q)
+
+
+        #branches can be scored in other processes, so the times come back with the result
+        def traceBranch(branch):
+            watch = tracer.stopwatch()
+            return scoreBranch(branch, watch), watch.times
+
+
+        #the reduction runs in branch order so every executor promotes the same branch
+        for (l, opbranch), (result, times) in zip(branches, executor.map(traceBranch, branches)):
+
+            if times:
+                tracer.addTimes(times)
+
+            if result == BRANCH_ERROR:
+                bad_op_cache.add(opbranch.name)
+                tracer.branchPruned(i, l, opbranch, result)
+                continue
+
+            elif result == BRANCH_PRUNED or result == BRANCH_DUPLICATE or result == BRANCH_TIMEOUT:
+                tracer.branchPruned(i, l, opbranch, result)
+                continue
+
+            n, output, key, q = result
+
+            #without shared memory duplicates in other workers are also scored
+            if key in transpositions:
+                tracer.branchPruned(i, l, opbranch, BRANCH_DUPLICATE)
                 continue
 
-            costEval = costFn.qfn(output)
-            n = (np.sum(costEval) + editCost*editfn)/output.shape[0]
+            transpositions.add(key)
 
-            if n < best[0]:
+            #workers that don't share memory only send back scores, the state
+            #is rerun from the parent if the node is ever needed
+            child = SearchNode(n, op * opbranch, output, opbranch, frame)
+            child.quality = q
+
+            tracer.branchEvaluated(i, l, opbranch, n)
+
+            if n < best.value:
                 logging.debug('Promoted Search Branch='+str(l)+' ' + opbranch.name)
-                best = (n, nextop, output)
+                tracer.branchPromoted(i, l, opbranch, n)
+                best = child
+                stale = 0
+
+            if n <= best.value*inflation:
+                frontier.push(child)
+
+        tracer.levelEnd(i, len(branches))
 
         logging.debug('Search Depth='+str(i) + " took " + str((datetime.datetime.now()-level_start_time).total_seconds()))
 
     logging.debug('Search  took ' + str((datetime.datetime.now()-search_start_time).total_seconds()))
             
-    return best[1], best[2], (all_operations.difference(set(best[1].provenance)), set(best[1].provenance))
+    training = (all_operations.difference(set(best.op.provenance)), set(best.op.provenance))
+
+    #the deletes of the search match the index labels of its rows, the program
+    #that is returned deletes rows by their content so it runs on other frames,
+    #and the frame that is returned is the output of the program (the states of
+    #the search don't cast the columns like the operations do)
+    program, output = contentProgram(best.op, source)
+
+    return program, output, training
+
+
+
+class SearchNode(object):
+    """A node of the search: a program, its cost, and the state it produces. 
+    The state can be left out and rerun from the parent state.
+    """
+
+    def __init__(self, value, op, state, branch=None, parent=None):
+        self.value = value
+        self.quality = None
+        self.scores = None
+        self.op = op
+        self.state = state
+        self.branch = branch
+        self.parent = parent
+
+
+    def realize(self):
+        if self.state is None:
+            self.state = self.branch.runOverlay(self.parent)[0]
+
+        return self.state
+
+
+    def memoryUsage(self):
+        if self.state is None:
+            return 0
+
+        return self.state.memoryUsage()
+
+
+
+class Frontier(object):
+    """The frontier is a priority queue of search nodes keyed on cost, ties are
+    broken by insertion order. It is bounded by a number of nodes and by the
+    estimated memory of their states, the worst nodes are dropped first.
+    """
+
+    def __init__(self, size=DEFAULT_FRONTIER_SIZE, memory=None):
+        self.size = size
+        self.memory = memory
+        self.heap = []
+        self.counter = 0
+        self.usage = 0
+
+
+    def push(self, node):
+        heappush(self.heap, (node.value, self.counter, node))
+        self.counter += 1
+        self.usage += node.memoryUsage()
+
+        if (self.size != None and len(self.heap) > self.size) or \
+           (self.memory != None and self.usage > self.memory):
+            self.trim()
+
+
+    def pop(self):
+        node = heappop(self.heap)[2]
+        self.usage -= node.memoryUsage()
+        return node
+
+
+    def trim(self):
+        #heap order sorts by cost and then by insertion order
+        self.heap.sort()
+
+        if self.size != None:
+            self.heap = self.heap[:self.size]
+
+        self.usage = sum(entry[2].memoryUsage() for entry in self.heap)
+
+        while self.memory != None and self.usage > self.memory and len(self.heap) > 1:
+            self.usage -= self.heap.pop()[2].memoryUsage()
+
+
+    def __len__(self):
+        return len(self.heap)
+
+
+def rootValue(df, costFn, efn, editCost, tracer=NULL_TRACER):
+    """The cost, the constraint cost and the score vectors (None for an empty
+    instance) of the unmodified instance
+    """
+
+    if df.shape[0] == 0:
+        return 2.0, 0.0, None
+
+    with tracer.timer('quality-fn'):
+        costEval = costFn.qfn(df)
+
+    with tracer.timer('edit-cost'):
+        editEval = efn(df)
+
+    quality = np.sum(costEval)
+
+    return (quality + editCost*np.sum(editEval))/df.shape[0], quality/df.shape[0], (costEval, editEval)
+
+
+#sentinels for branches that were not scored
+BRANCH_ERROR = 'error'
+BRANCH_PRUNED = 'pruned'
+BRANCH_DUPLICATE = 'duplicate'
+BRANCH_TIMEOUT = 'timeout'
+
+
+
+def deadlineAfter(seconds, deadline=None):
+    """Returns the earlier of a deadline and the time a number of seconds from now,
+    None means no deadline
+    """
+
+    if seconds == None:
+        return deadline
+
+    after = time.time() + seconds
+
+    if deadline == None:
+        return after
+
+    return min(after, deadline)
+
+
+def expired(deadline):
+    """Returns true if the deadline has passed"""
+    return deadline != None and time.time() >= deadline
 
 
 def pruningRules(output):
@@ -0,0 +1,185 @@
+"""
+Module: word2vec
+
+The pre-trained word2vec models are large (the GoogleNews vectors are 3.6GB),
+so they are loaded once per process and shared. The first time a model is
+loaded, the binary is converted into gensim's own format next to it, with the
+vectors normalized and saved as a numpy array. After that the vectors are
+memory-mapped read-only: loading takes seconds, the pages are only read as
+they are needed, and the workers of a process executor share the pages of
+their parent instead of each holding a copy. The semantic distances of the
+phrases of a model are computed in batches by its Embeddings.
+"""
+
+import os
+import logging
+import numpy as np
+
+
+#the loaded models by the absolute path of their binary
+MODELS = {}
+
+#the extension of a converted model
+CONVERTED = '.kv'
+
+
+def loadWord2Vec(filename):
+    """Returns the word2vec model of a binary file, the same instance for every
+    call in the process
+
+    Positional arguments:
+    filename -- the path of a binary word2vec file (e.g., resources/GoogleNews-vectors-negative300.bin)
+    """
+
+    key = os.path.abspath(filename)
+
+    if key not in MODELS:
+        MODELS[key] = openModel(filename)
+
+    return MODELS[key]
+
+
+
+def openModel(filename):
+    """Memory-maps the converted model of a binary file, converting it first if
+    it doesn't exist or is older than the binary
+    """
+    from gensim.models.keyedvectors import KeyedVectors
+
+    converted = filename + CONVERTED
+
+    if not os.path.exists(converted) or os.path.getmtime(converted) < os.path.getmtime(filename):
+        logging.info('Converting the word2vec model ' + filename + ' to ' + converted)
+
+        model = KeyedVectors.load_word2vec_format(filename, binary=True)
+        model.init_sims(replace=True)
+
+        try:
+            model.save(converted)
+        except (IOError, OSError):
+            logging.warning('Could not save the converted word2vec model ' + converted + ', keeping it in memory')
+            return model
+
+        del model
+
+    model = KeyedVectors.load(converted, mmap='r')
+
+    #the saved vectors are normalized, so they are their own normalized
+    #vectors (otherwise the first similarity would normalize a copy)
+    if hasattr(model, 'vectors_norm'):
+        model.vectors_norm = model.vectors
+    elif hasattr(model, 'syn0norm'):
+        model.syn0norm = model.syn0
+
+    return model
+
+
+
+class Embeddings(object):
+    """The semantic distances between phrases of a word2vec model, in batches.
+    The distance of two phrases is one minus the mean similarity of their pairs
+    of distinct (lowercase) tokens, where the similarity of two words is their
+    cosine similarity scaled to [0, 1] and a word that the model doesn't know
+    has a similarity of 0. The similarities of all pairs sum to
+
+        (S_t . S_r + n_t n_r)/2
+
+    where S is the sum of the unit vectors of the known words of a phrase and n
+    is their number, so every phrase is embedded once and the distances of many
+    phrases are one matrix multiply.
+    """
+
+    #number of phrases and words to remember
+    CACHE_SIZE = 10000
+
+    def __init__(self, model):
+        """Embeddings constructor
+
+        Positional arguments:
+        model -- a word2vec model (KeyedVectors) or None, where no word is known
+        """
+
+        self.model = model
+        self.size = getattr(model, 'vector_size', 1)
+
+        self.words = {}
+        self.phrases = {}
+
+
+    def word(self, token):
+        """The unit vector of a word, None if the model doesn't know it"""
+
+        if token not in self.words:
+
+            try:
+                vector = np.asarray(self.model[token], dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                vector = vector/norm if norm > 0 else vector
+            except Exception:
+                vector = None
+
+            if len(self.words) >= self.CACHE_SIZE:
+                self.words.clear()
+
+            self.words[token] = vector
+
+        return self.words[token]
+
+
+    def phrase(self, text):
+        """The sum of the unit vectors of the known words of a phrase, the number
+        of known words and the number of words
+        """
+
+        if text not in self.phrases:
+            tokens = set(text.lower().split())
+            vectors = [v for v in (self.word(t) for t in tokens) if v is not None]
+
+            total = np.sum(vectors, axis=0) if len(vectors) > 0 else np.zeros((self.size,), dtype=np.float32)
+
+            if len(self.phrases) >= self.CACHE_SIZE:
+                self.phrases.clear()
+
+            self.phrases[text] = (total, len(vectors), len(tokens))
+
+        return self.phrases[text]
+
+
+    def distances(self, targets, refs):
+        """The matrix of the distances of every target to every ref (phrases are strings)"""
+
+        if len(targets) == 0 or len(refs) == 0:
+            return np.ones((len(targets), len(refs)))
+
+        t = [self.phrase(p) for p in targets]
+        r = [self.phrase(p) for p in refs]
+
+        dots = np.dot(np.array([p[0] for p in t]).reshape((len(t), -1)),
+                      np.array([p[0] for p in r]).reshape((len(r), -1)).T)
+
+        known = np.outer([p[1] for p in t], [p[1] for p in r])
+        pairs = np.outer([p[2] for p in t], [p[2] for p in r])
+
+        return np.where(pairs > 0, 1.0 - (dots + known)/(2.0*np.maximum(pairs, 1)), 1.0)
+
+
+    def distance(self, target, ref):
+        return self.distances([target], [ref])[0, 0]
+
+
+
+#the embeddings of every model (the model is kept so its id isn't reused)
+EMBEDDINGS = {}
+
+
+def getEmbeddings(model):
+    """Returns the Embeddings of a model, the same instance for every call
+
+    Positional arguments:
+    model -- a word2vec model or None
+    """
+
+    if id(model) not in EMBEDDINGS:
+        EMBEDDINGS[id(model)] = (model, Embeddings(model))
+
+    return EMBEDDINGS[id(model)][1]
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the solver. The scenarios mirror the examples, benchmarks.run
+measures them and benchmarks.compare flags the regressions between two runs.
+"""
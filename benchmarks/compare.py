@@ -0,0 +1,139 @@
+"""
+Module: compare
+
+Compares two benchmark runs and flags the regressions: scenarios that got
+slower or used more memory by more than a threshold, that clean worse (a higher
+final cost), or that stopped running. Exits with a non-zero status if any
+scenario regressed, so it can gate a change:
+
+    python -m benchmarks.compare before.json after.json
+    python -m benchmarks.compare before.json after.json --time 0.2 --memory 0.2
+"""
+
+import sys
+import json
+import argparse
+
+
+#a regression has to be larger than the noise of tiny measurements
+MIN_SECONDS = 0.05
+MIN_MB = 1.0
+
+
+def compare(before, after, time=0.1, memory=0.1, cost=1e-6):
+    """Compares two benchmark results and returns a list of rows
+    (scenario, metric, before, after, relative change, regression)
+
+    Positional arguments:
+    before -- the results of a run (see benchmarks.run)
+    after -- the results of a later run
+
+    Keyword arguments:
+    time -- the relative increase in time that is a regression
+    memory -- the relative increase in memory that is a regression
+    cost -- the absolute increase in final cost that is a regression
+    """
+
+    rows = []
+
+    for name in sorted(set(before['scenarios']).union(after['scenarios'])):
+
+        a = before['scenarios'].get(name)
+        b = after['scenarios'].get(name)
+
+        if a == None or b == None:
+            rows.append((name, 'scenario', status(a), status(b), None, False))
+            continue
+
+        if status(a) != 'ok' or status(b) != 'ok':
+            rows.append((name, 'scenario', status(a), status(b), None, status(a) == 'ok'))
+            continue
+
+        rows.append(row(name, 'time', a['time'], b['time'], time, MIN_SECONDS))
+        rows.append(row(name, 'memory', a['memory'], b['memory'], memory, MIN_MB))
+        rows.append(row(name, 'branches', a['branches'], b['branches']))
+
+        rows.append((name, 'final_cost', a['final_cost'], b['final_cost'], change(a['final_cost'], b['final_cost']),
+                     b['final_cost'] > a['final_cost'] + cost))
+
+    return rows
+
+
+
+def row(name, metric, a, b, threshold=None, floor=0):
+    """A row for a metric where an increase beyond the relative threshold (and
+    beyond the floor) is a regression, a threshold of None never regresses
+    """
+
+    regression = threshold != None and b - a > max(threshold*a, floor)
+
+    return (name, metric, a, b, change(a, b), regression)
+
+
+def change(a, b):
+    if a == 0:
+        return None
+
+    return (b - a)/float(a)
+
+
+def status(result):
+    if result == None:
+        return 'missing'
+    elif 'skipped' in result:
+        return 'skipped'
+    elif 'error' in result:
+        return 'error'
+    else:
+        return 'ok'
+
+
+
+def report(rows):
+    """Formats the rows of a comparison as a table"""
+
+    lines = ['%-24s %-12s %12s %12s %9s' % ('scenario', 'metric', 'before', 'after', 'change')]
+
+    for name, metric, a, b, c, regression in rows:
+        lines.append('%-24s %-12s %12s %12s %9s%s' % (name, metric, fmt(a), fmt(b),
+                     '' if c == None else '%+.1f%%' % (100*c), '  REGRESSION' if regression else ''))
+
+    return '\n'.join(lines)
+
+
+def fmt(v):
+    if isinstance(v, float):
+        return '%.4g' % v
+
+    return str(v)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compares two alphaclean benchmark runs')
+    parser.add_argument('before', help='the results of the baseline run')
+    parser.add_argument('after', help='the results of the new run')
+    parser.add_argument('--time', type=float, default=0.1, help='relative slowdown that is a regression')
+    parser.add_argument('--memory', type=float, default=0.1, help='relative memory increase that is a regression')
+    parser.add_argument('--cost', type=float, default=1e-6, help='final cost increase that is a regression')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+
+    with open(args.after) as f:
+        after = json.load(f)
+
+    rows = compare(before, after, args.time, args.memory, args.cost)
+
+    print(report(rows))
+
+    regressions = [r for r in rows if r[5]]
+
+    if len(regressions) > 0:
+        print(str(len(regressions)) + ' regressions')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Module: run
+
+Runs the benchmark scenarios and saves the results as JSON. Every scenario runs
+in a fresh process, so the peak memory is the memory of that scenario alone.
+Run the benchmarks from the root of the repository:
+
+    python -m benchmarks.run --out before.json
+    python -m benchmarks.run airplane weather --rows 100 --out before.json
+"""
+
+import sys
+import time
+import json
+import random
+import logging
+import platform
+import argparse
+import traceback
+import subprocess
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.scenarios import SCENARIOS, ROOT, getScenario
+from alphaclean.search import solve
+from alphaclean.profiling import Profiler
+
+
+def runScenario(scenario, rows=None, repeat=1):
+    """Runs a scenario a number of times and returns its measurements as a dict.
+    The time is the fastest run and the memory is the largest.
+
+    Positional arguments:
+    scenario -- a Scenario
+
+    Keyword arguments:
+    rows -- the number of rows to load (defaults to the scenario's rows)
+    repeat -- the number of runs
+    """
+
+    missing = scenario.missing()
+
+    if len(missing) > 0:
+        return {'skipped': 'missing ' + ', '.join(missing)}
+
+    if rows == None:
+        rows = scenario.rows
+
+    results = [measure(scenario, rows) for i in range(repeat)]
+
+    for r in results:
+        if 'error' in r:
+            return r
+
+    result = results[0]
+    result['time'] = min(r['time'] for r in results)
+    result['memory'] = max(r['memory'] for r in results)
+    result['peak_memory'] = max(r['peak_memory'] for r in results)
+    result['runs'] = repeat
+
+    return result
+
+
+
+def measure(scenario, rows):
+    """Runs a scenario once in a forked process"""
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+
+    process = multiprocessing.Process(target=_measure, args=(scenario, rows, sender))
+    process.start()
+    sender.close()
+
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': 'the benchmark process exited with code ' + str(process.exitcode)}
+
+    process.join()
+
+    return result
+
+
+
+def _measure(scenario, rows, sender):
+
+    try:
+        random.seed(0)
+        np.random.seed(0)
+
+        p = scenario.load(rows)
+        constraints = p['patterns'] + p['dependencies']
+
+        profiler = Profiler()
+        baseline = peakMemory()
+
+        start = time.time()
+        op, output = solve(p['df'], p['patterns'], p['dependencies'], p['partitionOn'], p['config'], tracer=profiler)
+        elapsed = time.time() - start
+
+        summary = profiler.summary()
+
+        result = {'rows': p['df'].shape[0],
+                  'time': elapsed,
+                  'peak_memory': peakMemory(),
+                  'memory': peakMemory() - baseline,
+                  'branches': summary['counters'].get('branches.evaluated', 0),
+                  'counters': summary['counters'],
+                  'timers': summary['timers'],
+                  'operations': len(op.provenance),
+                  'final_cost': cost(output, constraints)}
+
+    except Exception:
+        result = {'error': traceback.format_exc()}
+
+    sender.send(result)
+    sender.close()
+
+
+
+def cost(df, constraints):
+    """The sum of the average constraint costs of a cleaned dataframe (the
+    constraints assume that the pattern casts of the solver have run)
+    """
+
+    if df.shape[0] == 0:
+        return 0.0
+
+    return float(sum(np.sum(c.qfn(df))/df.shape[0] for c in constraints))
+
+
+
+def peakMemory():
+    """The peak resident memory of this process in MB"""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    #linux reports kilobytes and mac os bytes
+    if sys.platform == 'darwin':
+        return peak/(1024.*1024.)
+
+    return peak/1024.
+
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode().strip()
+    except Exception:
+        return None
+
+
+
+def run(names=None, rows=None, repeat=1):
+    """Runs the scenarios (all of them by default) and returns the results as a dict"""
+
+    scenarios = SCENARIOS if not names else [getScenario(n) for n in names]
+
+    results = {'meta': {'revision': revision(),
+                        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'pandas': pd.__version__,
+                        'rows': rows,
+                        'repeat': repeat},
+               'scenarios': {}}
+
+    for s in scenarios:
+        logging.info('Running benchmark=' + s.name + ' (' + s.example + ')')
+
+        results['scenarios'][s.name] = runScenario(s, rows, repeat)
+
+        logging.info('Benchmark=' + s.name + ' ' + describe(results['scenarios'][s.name]))
+
+    return results
+
+
+
+def describe(result):
+
+    if 'skipped' in result:
+        return 'skipped, ' + result['skipped']
+
+    if 'error' in result:
+        return 'failed\n' + result['error']
+
+    return 'time=%.2fs memory=%.1fMB branches=%d cost=%.4f' % \
+           (result['time'], result['memory'], result['branches'], result['final_cost'])
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the alphaclean benchmarks')
+    parser.add_argument('scenarios', nargs='*', help='the scenarios to run (default all): ' + \
+                        ', '.join(s.name for s in SCENARIOS))
+    parser.add_argument('--rows', type=int, default=None, help='the number of rows of every dataset')
+    parser.add_argument('--repeat', type=int, default=1, help='the number of runs of every scenario')
+    parser.add_argument('--out', default=None, help='the JSON file to write the results to')
+    args = parser.parse_args(argv)
+
+    #the solver logs every branch at the debug level
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    results = run(args.scenarios, args.rows, args.repeat)
+
+    if args.out != None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
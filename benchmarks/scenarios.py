@@ -0,0 +1,312 @@
+"""
+Module: scenarios
+
+The benchmark scenarios mirror the examples in the examples folder. A scenario
+loads a cleaning problem: the dataframe, the constraints, the blocking rule and
+the solver config. Every scenario starts from its own copy of the default
+config, so scenarios don't depend on the order in which they run.
+"""
+
+import os
+import copy
+import numpy as np
+import pandas as pd
+
+from alphaclean.search import DEFAULT_SOLVER_CONFIG
+from alphaclean.ops import Swap, Delete
+from alphaclean.misc import generateCodebook, generateCorrelationCodebook
+from alphaclean.constraint_languages.ic import OneToOne, DictValue, DenialConstraint, DCPredicate, DCConstant, DCPair
+from alphaclean.constraint_languages.pattern import Date, Pattern, Float
+from alphaclean.constraint_languages.statistical import Parameteric, Correlation, NumericalRelationship
+
+
+#the datasets are relative to the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+W2V = 'resources/GoogleNews-vectors-negative300.bin'
+
+
+class Scenario(object):
+    """A scenario is a named cleaning problem
+    """
+
+    def __init__(self, name, example, load, rows=None, requires=[]):
+        """Scenario constructor
+
+        Positional arguments:
+        name -- the name of the scenario
+        example -- the example script that the scenario mirrors
+        load -- a function rows -> problem dict (see problem)
+
+        Keyword arguments:
+        rows -- the default number of rows to load (None is the whole dataset)
+        requires -- files (relative to the repository) the scenario needs
+        """
+        self.name = name
+        self.example = example
+        self.load = load
+        self.rows = rows
+        self.requires = requires
+
+
+    def missing(self):
+        """Returns the required files that don't exist"""
+        return [f for f in self.requires if not os.path.exists(path(f))]
+
+
+
+def problem(df, patterns=[], dependencies=[], partitionOn=None, config=None):
+    """The arguments of solve as a dict"""
+    return {'df': df,
+            'patterns': patterns,
+            'dependencies': dependencies,
+            'partitionOn': partitionOn,
+            'config': config or defaultConfig()}
+
+
+def defaultConfig():
+    return copy.deepcopy(DEFAULT_SOLVER_CONFIG)
+
+
+def path(filename):
+    return os.path.join(ROOT, filename)
+
+
+def readTabular(filename, separator, rows=None, skip=0):
+    """Reads a delimited file into a dataframe with the column numbers as names"""
+
+    with open(path(filename), 'r') as f:
+        lines = f.readlines()[skip:]
+
+    if rows != None:
+        lines = lines[:rows]
+
+    return pd.DataFrame([dict((str(i), j) for i, j in enumerate(l.strip().split(separator))) for l in lines])
+
+
+def readCSV(filename, rows=None):
+    return pd.read_csv(path(filename), quotechar='\"', index_col=False, nrows=rows)
+
+
+
+def cities(rows=None):
+    data = [{'a': 'New Yorks',     'b': 'NY'},
+            {'a': 'New York',      'b': 'NY'},
+            {'a': 'San Francisco', 'b': 'SF'},
+            {'a': 'San Francisco', 'b': 'SF'},
+            {'a': 'San Jose',      'b': 'SJ'},
+            {'a': 'New York',      'b': 'NY'},
+            {'a': 'San Francisco', 'b': 'SFO'},
+            {'a': 'Berkeley City', 'b': 'Bk'},
+            {'a': 'San Mateo',     'b': 'SMO'},
+            {'a': 'Albany',        'b': 'AB'},
+            {'a': 'San Mateo',     'b': 'SM'}]
+
+    config = defaultConfig()
+    config['dependency']['depth'] = 3
+    config['dependency']['similarity'] = {'a': 'jaccard'}
+
+    return problem(pd.DataFrame(data[:rows]), dependencies=[OneToOne(["a"], ["b"])], config=config)
+
+
+def airplane(rows=None):
+    df = readTabular('datasets/airplane.txt', '\t', rows)
+
+    patterns = [Date("2", "%m/%d/%Y %I:%M %p"),
+                Date("3", "%m/%d/%Y %I:%M %p"),
+                Pattern("4", '^[a-zA-Z][0-9]+'),
+                Date("5", "%m/%d/%Y %I:%M %p"),
+                Date("6", "%m/%d/%Y %I:%M %p"),
+                Pattern("7", '^[a-zA-Z][0-9]+')]
+
+    dependencies = [OneToOne(["1"], [str(i)]) for i in range(2, 8)]
+
+    config = defaultConfig()
+    config['dependency']['depth'] = 1
+    config['dependency']['operations'] = [Swap]
+
+    return problem(df, patterns, dependencies, partitionOn="1", config=config)
+
+
+def elections(rows=None):
+    df = readCSV('datasets/elections.txt', rows)
+
+    codes = generateCodebook(df, 'contbr_occupation')
+
+    config = defaultConfig()
+    config['dependency']['similarity'] = {'contbr_occupation': 'semantic'}
+    config['dependency']['operations'] = [Swap, Delete]
+    config['dependency']['depth'] = 1
+
+    return problem(df, dependencies=[DictValue('contbr_occupation', codes)],
+                   partitionOn='contbr_occupation', config=config)
+
+
+def weather(rows=None):
+    df = readTabular('datasets/weather.txt', '\t', rows)
+
+    patterns = [Float(str(i)) for i in [3, 5, 6, 7, 8, 9, 10]]
+
+    config = defaultConfig()
+    config['dependency']['operations'] = [Delete]
+
+    return problem(df, patterns, [Parameteric("5")], config=config)
+
+
+def villages(rows=None):
+    """The rainfall data and the locations (the first two lines) of the villages"""
+
+    with open(path('datasets/all_villages_2010-16.csv'), 'r') as f:
+        lines = f.readlines()
+
+    locations = [dict((str(i), j) for i, j in enumerate(l.strip().split(',')) if i >= 3) for l in lines[0:2]]
+
+    df = readTabular('datasets/all_villages_2010-16.csv', ',', rows, skip=2)
+
+    #the nearest other village of every village
+    nearest = {}
+
+    for l in locations[0]:
+        lat_long = np.array([float(locations[0][l]), float(locations[1][l])])
+
+        distances = sorted((np.linalg.norm(np.array([float(locations[0][other]), float(locations[1][other])]) - lat_long), other)
+                           for other in locations[0] if l != other)
+
+        nearest[l] = distances[0]
+
+    patterns = [Float(str(i), [0, np.inf]) for i in range(3, 84)]
+
+    config = defaultConfig()
+    config['pattern']['depth'] = 0
+    config['dependency']['operations'] = [Delete]
+    config['dependency']['depth'] = 1
+
+    return df, patterns, nearest, config
+
+
+def rainfallCorrelation(rows=None):
+    df, patterns, nearest, config = villages(rows)
+    models = [Correlation([l, nearest[l][1]]) for l in sorted(nearest)]
+    return problem(df, patterns, models, config=config)
+
+
+def rainfallCasts(rows=None):
+    """Only the pattern phase: the numerical casts of the 81 rainfall columns"""
+    df, patterns, nearest, config = villages(rows)
+    return problem(df, patterns, config=config)
+
+
+def rainfallRelationship(rows=None):
+    df, patterns, nearest, config = villages(rows)
+    models = [NumericalRelationship([l, nearest[l][1]], lambda x: x) for l in sorted(nearest) if nearest[l][0] == 0.0]
+    return problem(df, patterns, models, config=config)
+
+
+def pcari(rows=None):
+    df = readCSV('datasets/pcari_csv.csv', rows)
+
+    patterns = [DictValue('Gender', set(['M', 'F'])),
+                Float('Age', [18, 100]),
+                Pattern('Comment', "^[a-zA-Z0-9_]*$")]
+
+    codes = generateCodebook(df, 'Barangay', size=100)
+    codes = [c for c in codes if not 'x' in c.lower() and not '--' in c.lower()]
+
+    config = defaultConfig()
+    config['pattern']['depth'] = 2
+    config['dependency']['similarity'] = {'Barangay': 'jaccard'}
+    config['dependency']['operations'] = [Swap]
+    config['dependency']['edit'] = 70
+
+    return problem(df, patterns, [DictValue('Barangay', codes)], partitionOn="Barangay", config=config)
+
+
+def salaryConstraint():
+    #a manager that is paid less than an employee
+    return DenialConstraint([DCConstant('title', 'contains', 'Manager'),
+                             DCConstant('title', 'contains', 'Employee', other=True),
+                             DCPair('salary', '<', 'salary')])
+
+
+def salaryLambdaConstraint():
+    #the same constraint with lambdas
+    predicate1 = DCPredicate(local_attr='title', expression=lambda value, data_frame: 'Manager' in value)
+
+    predicate2 = DCPredicate(local_attr='salary', expression=lambda value, data_frame: \
+                             data_frame[(data_frame['salary'] > value) & \
+                             data_frame['title'].str.contains("Employee", na=False)].shape[0] > 0)
+
+    return DenialConstraint([predicate1, predicate2])
+
+
+def salaries(rows=None, operations=[Swap], edit=1, manager=80.0, constraint=salaryConstraint):
+    data = [{'title': 'Employee 1', 'salary': 100.0},
+            {'title': 'Employee 2', 'salary': 100.0},
+            {'title': 'Employee 3', 'salary': 100.0},
+            {'title': 'Employee 4', 'salary': 100.0},
+            {'title': 'Manager 1', 'salary': 500.0},
+            {'title': 'Manager 2', 'salary': manager}]
+
+    config = defaultConfig()
+    config['dependency']['operations'] = operations
+    config['dependency']['edit'] = edit
+
+    return problem(pd.DataFrame(data[:rows]), dependencies=[constraint()], config=config)
+
+
+def salariesBig(rows=None):
+    """A synthetic payroll where a few managers are paid less than some employees"""
+
+    rows = rows or 2000
+    random = np.random.RandomState(0)
+
+    managers = random.rand(rows) < 0.1
+    salary = np.where(managers, random.randint(400, 600, rows), random.randint(50, 450, rows)).astype(float)
+
+    df = pd.DataFrame({'title': [('Manager ' if m else 'Employee ') + str(i) for i, m in enumerate(managers)],
+                       'salary': salary})
+
+    config = defaultConfig()
+    config['dependency']['operations'] = [Delete]
+
+    return problem(df, dependencies=[salaryConstraint()], config=config)
+
+
+def electionsBig(rows=None):
+    df = readCSV('datasets/elections.txt-big', rows)
+
+    codes = generateCorrelationCodebook(df, 'contbr_occupation', df['contbr_st'] == 'AK', size=100)
+
+    config = defaultConfig()
+    config['dependency']['similarity'] = {'contbr_occupation': 'semantic'}
+    config['dependency']['operations'] = [Swap]
+    config['dependency']['depth'] = 1
+    config['dependency']['w2v'] = W2V
+
+    return problem(df, dependencies=[DictValue('contbr_occupation', codes)],
+                   partitionOn='contbr_occupation', config=config)
+
+
+
+SCENARIOS = [Scenario('cities', 'example1', cities),
+             Scenario('airplane', 'example2', airplane, rows=200),
+             Scenario('elections', 'example3', elections, requires=[W2V]),
+             Scenario('weather', 'example4', weather, rows=1000),
+             Scenario('rainfall-correlation', 'example5', rainfallCorrelation, rows=200),
+             Scenario('rainfall-casts', 'example5', rainfallCasts, rows=1000),
+             Scenario('pcari', 'example6', pcari),
+             Scenario('rainfall-relationship', 'example7', rainfallRelationship, rows=200),
+             Scenario('salaries', 'example8', salaries),
+             Scenario('salaries-delete', 'example8', lambda rows=None: salaries(rows, [Delete])),
+             Scenario('salaries-lambda', 'example8', lambda rows=None: salaries(rows, constraint=salaryLambdaConstraint)),
+             Scenario('salaries-swap-delete', 'example8', lambda rows=None: salaries(rows, [Swap, Delete], 0, 50.0)),
+             Scenario('salaries-big', 'example8', salariesBig),
+             Scenario('elections-big', 'example9', electionsBig, requires=['datasets/elections.txt-big', W2V])]
+
+
+def getScenario(name):
+    for s in SCENARIOS:
+        if s.name == name:
+            return s
+
+    raise ValueError('Unknown scenario: ' + str(name))
@@ -12,17 +12,12 @@ import pandas as pd
 df = pd.DataFrame(data)
 
 
-from alphaclean.constraint_languages.ic import DenialConstraint, DCPredicate
+from alphaclean.constraint_languages.ic import DenialConstraint, DCConstant, DCPair
 
-#Employee is a manager
-predicate1 = DCPredicate(local_attr='title', expression= lambda value, data_frame: 'Manager' in value)
-
-#There exists an employee with a salary greater than the given manager's salary
-predicate2 = DCPredicate(local_attr='salary', expression= lambda value, data_frame: \
-                                                        data_frame[ (data_frame['salary'] > value) & \
-                                                        data_frame['title'].str.contains("Employee", na=False) ].shape[0] > 0)
-
-constraint = DenialConstraint([predicate1, predicate2])
+#t1 is a manager, t2 is an employee, and the manager makes less than the employee
+constraint = DenialConstraint([DCConstant('title', 'contains', 'Manager'),
+                               DCConstant('title', 'contains', 'Employee', other=True),
+                               DCPair('salary', '<', 'salary')])
 
 
 from alphaclean.search import solve